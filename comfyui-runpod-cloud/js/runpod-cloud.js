@@ -145,6 +145,17 @@ const STYLES = `
   margin-top: 4px;
 }
 
+.runpod-preview {
+  display: none;
+  width: 100%;
+  margin-top: 8px;
+  border-radius: 4px;
+  image-rendering: auto;
+}
+.runpod-preview.visible {
+  display: block;
+}
+
 .runpod-overlay.success .runpod-overlay-header { background: #1a3a1a; }
 .runpod-overlay.error .runpod-overlay-header { background: #3a1a1a; }
 .runpod-overlay.cancelled .runpod-overlay-header { background: #3a2a1a; }
@@ -310,6 +321,7 @@ function createOverlay() {
       </div>
       <div class="runpod-status-text">Submitting workflow...</div>
       <div class="runpod-meta-text"></div>
+      <img class="runpod-preview" alt="Preview" />
     </div>
   `;
   overlay.querySelector(".runpod-overlay-close").addEventListener("click", removeOverlay);
@@ -353,6 +365,13 @@ function setPhase(phase, label) {
   progressState.phase = phase;
 }
 
+function showPreview(preview) {
+  const img = document.querySelector("#runpod-overlay .runpod-preview");
+  if (!img || !preview?.data) return;
+  img.src = `data:${preview.content_type || "image/jpeg"};base64,${preview.data}`;
+  img.classList.add("visible");
+}
+
 function updateOverlay(message, overallPct = null, stepPct = null) {
   const overlay = document.getElementById("runpod-overlay");
   if (!overlay) return;
@@ -478,10 +497,27 @@ async function submitWorkflow(endpointUrl, apiKey, workflow, extraInput = {}) {
   return data.id;
 }
 
+// Large outputs arrive as sequenced output_part chunks. Each part is a whole
+// number of base64 quanta, so joining the parts in order gives the full data.
+function collectPart(parts, output) {
+  const key = `${output.batch_index ?? ""}:${output.filename}`;
+  (parts[key] ||= [])[output.part] = output.data;
+}
+
+function assembleChunked(output, parts) {
+  if (!output || !output.images) return output;
+  for (const img of output.images) {
+    const chunks = parts[`${img.batch_index ?? ""}:${img.filename}`];
+    if (img.chunked && chunks) img.data = chunks.join("");
+  }
+  return output;
+}
+
 async function pollStream(endpointUrl, apiKey, jobId, signal) {
   const headers = { "Authorization": `Bearer ${apiKey}` };
   const seenIndices = new Set();
   const start = Date.now();
+  const parts = {};
   let finalOutput = null;
 
   while (Date.now() - start < POLL_TIMEOUT) {
@@ -514,6 +550,16 @@ async function pollStream(endpointUrl, apiKey, jobId, signal) {
             continue;
           }
 
+          if (output.status === "output_part") {
+            collectPart(parts, output);
+            continue;
+          }
+
+          if (output.status === "preview") {
+            showPreview(output.preview);
+            continue;
+          }
+
           // Update tracking state from enriched fields
           if (output.total_nodes) progressState.totalNodes = output.total_nodes;
           if (output.elapsed != null) progressState.elapsed = output.elapsed;
@@ -530,11 +576,13 @@ async function pollStream(endpointUrl, apiKey, jobId, signal) {
             setPhase("waiting", "Waiting for Server");
           } else if (output.status === "queued") {
             setPhase("queued", "Queued");
+          } else if (output.status === "downloading") {
+            setPhase("queued", "Downloading Models");
           } else if (output.status === "uploading") {
             setPhase("queued", "Uploading");
           } else if (output.status === "executing" || output.status === "running") {
             if (progressState.phase !== "executing") setPhase("executing", "Executing");
-          } else if (output.status === "collecting") {
+          } else if (output.status === "collecting" || output.status === "output") {
             setPhase("collecting", "Collecting");
           }
 
@@ -572,7 +620,7 @@ async function pollStream(endpointUrl, apiKey, jobId, signal) {
       // Stream endpoint may 404 early on, ignore and retry
     }
 
-    if (finalOutput) return finalOutput;
+    if (finalOutput) return assembleChunked(finalOutput, parts);
 
     // Check job status
     try {
@@ -582,13 +630,16 @@ async function pollStream(endpointUrl, apiKey, jobId, signal) {
         const jobStatus = statusData.status;
 
         if (jobStatus === "COMPLETED") {
-          if (finalOutput) return finalOutput;
+          if (finalOutput) return assembleChunked(finalOutput, parts);
           // Check aggregated output
           const agg = statusData.output;
           if (Array.isArray(agg)) {
+            for (const chunk of agg) {
+              if (chunk && chunk.status === "output_part") collectPart(parts, chunk);
+            }
             for (let i = agg.length - 1; i >= 0; i--) {
               if (agg[i] && (agg[i].images || agg[i].error)) {
-                return agg[i];
+                return assembleChunked(agg[i], parts);
               }
             }
             return agg[agg.length - 1] || { error: "No output" };
@@ -710,7 +761,8 @@ async function runOnCloud() {
     return;
   }
 
-  const extraInput = {};
+  // The overlay shows latent previews, which the worker only sends on request
+  const extraInput = { previews: true };
   const mmApiUrl = getSetting("RunPod.ModelManager.APIURL")?.trim();
   const mmApiKey = getSetting("RunPod.ModelManager.APIKey")?.trim();
   if (mmApiUrl && mmApiKey) {
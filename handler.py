@@ -1,21 +1,162 @@
 """RunPod serverless handler for ComfyUI workflows."""
 
+import asyncio
+import atexit
 import base64
+import contextlib
+import copy
+import cProfile
+import hashlib
 import io
 import json
+import mimetypes
 import os
+import pstats
+import queue
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 import urllib.parse
 import urllib.request
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 
 import boto3
 import requests
 import runpod
 import websocket
+import yaml
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from PIL import Image, UnidentifiedImageError
+from requests.adapters import HTTPAdapter
+
+from scripts import download_models
 
 COMFYUI_URL = os.environ.get("COMFYUI_URL", "http://127.0.0.1:8188")
 
+COMFYUI_DIR = os.environ.get("COMFYUI_DIR", "/comfyui")
+
+# Opt-in: read outputs straight from ComfyUI's output/temp dirs instead of /view
+LOCAL_OUTPUTS = os.environ.get("COMFYUI_LOCAL_OUTPUTS", "").lower() in ("1", "true", "yes")
+COMFYUI_OUTPUT_DIR = os.environ.get("COMFYUI_OUTPUT_DIR", os.path.join(COMFYUI_DIR, "output"))
+COMFYUI_TEMP_DIR = os.environ.get("COMFYUI_TEMP_DIR", os.path.join(COMFYUI_DIR, "temp"))
+COMFYUI_INPUT_DIR = os.environ.get("COMFYUI_INPUT_DIR", os.path.join(COMFYUI_DIR, "input"))
+
+# Jobs kept in flight per worker; ComfyUI's queue still serializes GPU execution
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "1"))
+
+# Max workflows queued by a single batch job
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "64"))
+
+# On-disk LRU of final results for repeated identical jobs (0 bytes disables it)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "/tmp/comfyui-result-cache")
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(1024 ** 3)))
+
+# Prompt time limits: the default and max per-job "timeout" in seconds, and how long an
+# executing prompt may go without progress or node events before it's interrupted
+# (per-job "stall_timeout"; 0 disables the watchdog)
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "600"))
+MAX_JOB_TIMEOUT = float(os.environ.get("MAX_JOB_TIMEOUT", "3600"))
+STALL_TIMEOUT = float(os.environ.get("STALL_TIMEOUT", "300"))
+
+# On-demand models: catalog fetched when a workflow references an entry, and the
+# disk budget for models fetched that way (0 = unlimited)
+MODELS_CATALOG = os.environ.get(
+    "MODELS_CATALOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "catalog.yaml")
+)
+MODEL_CACHE_BYTES = int(os.environ.get("MODEL_CACHE_BYTES", "0"))
+
+# On-demand models used this recently are never evicted; jobs with a longer
+# timeout hold the models they reference for that long instead
+MODEL_EVICT_GRACE = JOB_TIMEOUT
+
+# Validate workflows against a cached /object_info snapshot before queueing them
+WORKFLOW_PREFLIGHT = os.environ.get("WORKFLOW_PREFLIGHT", "1").lower() in ("1", "true", "yes")
+
+# Launch ComfyUI from this process and restart it when it exits (start.sh enables
+# this): main.py's arguments, restart backoff bounds in seconds, and how many lines
+# of its output are kept to explain a crash to the jobs it took down
+COMFYUI_SUPERVISE = os.environ.get("COMFYUI_SUPERVISE", "").lower() in ("1", "true", "yes")
+COMFYUI_ARGS = os.environ.get("COMFYUI_ARGS", "--disable-auto-launch --disable-metadata --listen --port 8188")
+COMFYUI_RESTART_BACKOFF = float(os.environ.get("COMFYUI_RESTART_BACKOFF", "1"))
+COMFYUI_RESTART_BACKOFF_MAX = float(os.environ.get("COMFYUI_RESTART_BACKOFF_MAX", "60"))
+COMFYUI_LOG_TAIL = int(os.environ.get("COMFYUI_LOG_TAIL", "40"))
+
+# Readiness latch: how long a job waits for ComfyUI, and how often a healthy server is re-probed
+SERVER_WAIT_TIMEOUT = float(os.environ.get("SERVER_WAIT_TIMEOUT", "25"))
+HEALTH_PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", "5"))
+
+# Keep-alive pool and retry policy for requests to ComfyUI
+COMFYUI_POOL_SIZE = int(os.environ.get("COMFYUI_POOL_SIZE", "16"))
+COMFYUI_RETRIES = int(os.environ.get("COMFYUI_RETRIES", "3"))
+COMFYUI_RETRY_BACKOFF = float(os.environ.get("COMFYUI_RETRY_BACKOFF", "0.1"))
+
+# Streaming fetch of url/s3:// input references
+FETCH_CHUNK_SIZE = 1024 * 1024
+FETCH_TIMEOUT = int(os.environ.get("FETCH_TIMEOUT", "60"))
+
+# How often the progress loop wakes up without a WebSocket event
+EVENT_POLL_INTERVAL = 0.25
+
+# Min seconds between step-progress chunks (node transitions always go out),
+# and between latent preview chunks for jobs with "previews": true (0 disables them)
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "0.5"))
+PREVIEW_INTERVAL = float(os.environ.get("PREVIEW_INTERVAL", "1.0"))
+PREVIEW_MAX_DIMENSION = int(os.environ.get("PREVIEW_MAX_DIMENSION", "256"))
+
+# Max input images uploaded to ComfyUI at once
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+
+# Max outputs fetched/encoded/uploaded at once; bounds raw bytes held in memory
+OUTPUT_WORKERS = int(os.environ.get("OUTPUT_WORKERS", "4"))
+
+# Outputs are inlined as base64 only while they fit these budgets (per output and
+# per job). Larger ones go to S3 (the job's, else the offload bucket below) or are
+# streamed as sequenced output_part chunks.
+INLINE_OUTPUT_BYTES = int(os.environ.get("INLINE_OUTPUT_BYTES", str(8 * 1024 * 1024)))
+INLINE_TOTAL_BYTES = int(os.environ.get("INLINE_TOTAL_BYTES", str(32 * 1024 * 1024)))
+
+# Raw bytes per output_part chunk; kept a multiple of 3 so parts base64-encode independently
+OUTPUT_PART_BYTES = max(3, int(os.environ.get("OUTPUT_PART_BYTES", str(3 * 1024 * 1024))) // 3 * 3)
+
+# Worker-level bucket for outputs too large to inline when the job has no s3 config
+OFFLOAD_S3_CONFIG = {
+    key: os.environ[f"OFFLOAD_S3_{key.upper()}"]
+    for key in ("bucket", "access_key", "secret_key", "region", "endpoint_url", "prefix")
+    if os.environ.get(f"OFFLOAD_S3_{key.upper()}")
+}
+if not {"bucket", "access_key", "secret_key"} <= OFFLOAD_S3_CONFIG.keys():
+    OFFLOAD_S3_CONFIG = None
+
+# Formats accepted by output_format, mapped to their Pillow encoder
+OUTPUT_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+
+# Rolling Prometheus metrics, rewritten after every job ("" disables the file),
+# and optionally served over HTTP on this port (0 = off)
+METRICS_FILE = os.environ.get("METRICS_FILE", "/tmp/comfyui-worker.prom")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Opt-in profiling of every job (jobs can also set "profile": true). Profiles go to
+# the job's S3 prefix when it has one, else PROFILE_DIR; stacks are sampled this often.
+PROFILE_JOBS = os.environ.get("PROFILE_JOBS", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/comfyui-profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# S3 client cache and multipart upload tuning
+S3_CLIENT_CACHE_SIZE = int(os.environ.get("S3_CLIENT_CACHE_SIZE", "8"))
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "16"))
+S3_MULTIPART_THRESHOLD = int(os.environ.get("S3_MULTIPART_THRESHOLD", str(16 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+S3_MULTIPART_CONCURRENCY = int(os.environ.get("S3_MULTIPART_CONCURRENCY", "8"))
+
 
 # ---------------------------------------------------------------------------
 # Validation
@@ -27,11 +168,40 @@ def validate_input(job_input: dict) -> tuple[dict | None, str | None]:
         return None, "No input provided"
 
     workflow = job_input.get("workflow")
-    if not workflow:
-        return None, "Missing 'workflow' field"
-
-    if not isinstance(workflow, dict):
-        return None, "'workflow' must be a JSON object (ComfyUI API format)"
+    workflows = job_input.get("workflows")
+    if workflows is not None:
+        if workflow is not None:
+            return None, "Provide either 'workflow' or 'workflows', not both"
+        if not isinstance(workflows, list) or not workflows:
+            return None, "'workflows' must be a non-empty list"
+        for i, wf in enumerate(workflows):
+            if not isinstance(wf, dict) or not wf:
+                return None, f"workflows[{i}] must be a JSON object (ComfyUI API format)"
+    else:
+        if not workflow:
+            return None, "Missing 'workflow' field"
+
+        if not isinstance(workflow, dict):
+            return None, "'workflow' must be a JSON object (ComfyUI API format)"
+
+    overrides = job_input.get("overrides")
+    if overrides is not None:
+        if workflows is not None:
+            return None, "'overrides' can only be combined with a single 'workflow'"
+        if not isinstance(overrides, list) or not overrides:
+            return None, "'overrides' must be a non-empty list"
+        for i, override in enumerate(overrides):
+            if not isinstance(override, dict):
+                return None, f"overrides[{i}] must map node IDs to input values"
+            for node_id, inputs in override.items():
+                if node_id not in workflow:
+                    return None, f"overrides[{i}] references unknown node '{node_id}'"
+                if not isinstance(inputs, dict):
+                    return None, f"overrides[{i}]['{node_id}'] must be an object of input values"
+
+    batch_size = len(workflows or overrides or [workflow])
+    if batch_size > MAX_BATCH_SIZE:
+        return None, f"Batch of {batch_size} exceeds the limit of {MAX_BATCH_SIZE} workflows"
 
     images = job_input.get("images", [])
     if images and not isinstance(images, list):
@@ -39,9 +209,15 @@ def validate_input(job_input: dict) -> tuple[dict | None, str | None]:
 
     for i, img in enumerate(images):
         if not isinstance(img, dict):
-            return None, f"images[{i}] must be an object with 'name' and 'image' fields"
-        if "name" not in img or "image" not in img:
-            return None, f"images[{i}] missing 'name' or 'image' field"
+            return None, f"images[{i}] must be an object with 'name' and 'image' or 'url' fields"
+        if "name" not in img or ("image" in img) == ("url" in img):
+            return None, f"images[{i}] needs 'name' and exactly one of 'image' or 'url'"
+        ref = img.get("url")
+        if ref is not None:
+            if not isinstance(ref, str) or not ref.startswith(("http://", "https://", "s3://")):
+                return None, f"images[{i}].url must be an http(s):// or s3:// reference"
+            if ref.startswith("s3://") and not job_input.get("s3"):
+                return None, f"images[{i}].url is an s3:// reference but no s3 config was provided"
 
     s3_config = job_input.get("s3")
     if s3_config:
@@ -50,6 +226,30 @@ def validate_input(job_input: dict) -> tuple[dict | None, str | None]:
             if key not in s3_config:
                 return None, f"s3 config missing '{key}'"
 
+    output_format = job_input.get("output_format")
+    if output_format is not None:
+        error = validate_output_format(output_format)
+        if error:
+            return None, error
+
+    if "cache" in job_input and not isinstance(job_input["cache"], bool):
+        return None, "'cache' must be true or false"
+
+    if "profile" in job_input and not isinstance(job_input["profile"], bool):
+        return None, "'profile' must be true or false"
+
+    if "previews" in job_input and not isinstance(job_input["previews"], bool):
+        return None, "'previews' must be true or false"
+
+    timeout = job_input.get("timeout")
+    if timeout is not None:
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout <= MAX_JOB_TIMEOUT:
+            return None, f"'timeout' must be a positive number of seconds, at most {MAX_JOB_TIMEOUT:g}"
+    stall_timeout = job_input.get("stall_timeout")
+    if stall_timeout is not None:
+        if isinstance(stall_timeout, bool) or not isinstance(stall_timeout, (int, float)) or stall_timeout < 0:
+            return None, "'stall_timeout' must be a number of seconds (0 disables it)"
+
     mm_config = job_input.get("model_manager")
     if mm_config:
         if not isinstance(mm_config, dict):
@@ -60,39 +260,424 @@ def validate_input(job_input: dict) -> tuple[dict | None, str | None]:
     return job_input, None
 
 
+def validate_output_format(output_format: dict) -> str | None:
+    """Check an output_format option; returns an error message or None."""
+    if not isinstance(output_format, dict):
+        return "'output_format' must be an object"
+    unknown = set(output_format) - {"format", "quality", "max_dimension", "thumbnail"}
+    if unknown:
+        return f"output_format has unknown field(s): {', '.join(sorted(unknown))}"
+    fmt = output_format.get("format", "png")
+    if fmt not in OUTPUT_FORMATS:
+        return f"output_format.format must be one of: {', '.join(OUTPUT_FORMATS)}"
+    if f".{fmt}" not in Image.registered_extensions():
+        return f"output_format.format '{fmt}' is not supported by this worker's Pillow build"
+    quality = output_format.get("quality")
+    if quality is not None and (isinstance(quality, bool) or not isinstance(quality, int) or not 1 <= quality <= 100):
+        return "output_format.quality must be an integer from 1 to 100"
+    for key in ("max_dimension", "thumbnail"):
+        value = output_format.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            return f"output_format.{key} must be a positive integer"
+    return None
+
+
+def expand_batch(job_input: dict) -> list[dict]:
+    """Return the workflows a validated job should queue.
+
+    Either the explicit 'workflows' list, one copy of 'workflow' per entry in
+    'overrides' (each patching node inputs), or just 'workflow'.
+    """
+    if "workflows" in job_input:
+        return job_input["workflows"]
+
+    workflow = job_input["workflow"]
+    overrides = job_input.get("overrides")
+    if not overrides:
+        return [workflow]
+
+    expanded = []
+    for override in overrides:
+        wf = copy.deepcopy(workflow)
+        for node_id, inputs in override.items():
+            wf[node_id].setdefault("inputs", {}).update(inputs)
+        expanded.append(wf)
+    return expanded
+
+
+# ---------------------------------------------------------------------------
+# ComfyUI HTTP client
+# ---------------------------------------------------------------------------
+
+class ComfyClient:
+    """Keep-alive HTTP client for a ComfyUI server.
+
+    Owns a pooled requests.Session that is reused across jobs on a warm worker.
+    Requests are retried with exponential backoff on connection errors (e.g. a
+    reset on a reused keep-alive connection) unless the caller passes
+    retry=False for non-idempotent calls.
+    """
+
+    def __init__(
+        self,
+        url: str = COMFYUI_URL,
+        pool_size: int = COMFYUI_POOL_SIZE,
+        retries: int = COMFYUI_RETRIES,
+        backoff: float = COMFYUI_RETRY_BACKOFF,
+    ):
+        self.url = url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, path: str, *, timeout: float, retry: bool = True, **kwargs) -> requests.Response:
+        """Send a request to ComfyUI, retrying on connection errors unless retry=False."""
+        attempts = 1 + (self.retries if retry else 0)
+        for attempt in range(attempts):
+            try:
+                return self.session.request(method, f"{self.url}{path}", timeout=timeout, **kwargs)
+            except requests.ConnectionError:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def get(self, path: str, *, timeout: float, **kwargs) -> requests.Response:
+        return self.request("GET", path, timeout=timeout, **kwargs)
+
+    def post(self, path: str, *, timeout: float, **kwargs) -> requests.Response:
+        return self.request("POST", path, timeout=timeout, **kwargs)
+
+
+_clients: dict[str, ComfyClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url: str = COMFYUI_URL) -> ComfyClient:
+    """Return the shared ComfyClient for a server URL."""
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = _clients[url] = ComfyClient(url)
+        return client
+
+
 # ---------------------------------------------------------------------------
 # ComfyUI server interaction
 # ---------------------------------------------------------------------------
 
+def probe_server(url: str = COMFYUI_URL) -> bool:
+    """Return True if ComfyUI answers /system_stats."""
+    try:
+        return get_client(url).get("/system_stats", timeout=2, retry=False).status_code == 200
+    except requests.RequestException:
+        return False
+
+
 def check_server(url: str = COMFYUI_URL, retries: int = 500, delay: float = 0.05) -> bool:
     """Poll ComfyUI server until it's ready."""
     for i in range(retries):
-        try:
-            resp = requests.get(f"{url}/system_stats", timeout=2)
-            if resp.status_code == 200:
-                return True
-        except requests.ConnectionError:
-            pass
+        if probe_server(url):
+            return True
         time.sleep(delay)
     return False
 
 
-def upload_images(images: list[dict], url: str = COMFYUI_URL):
-    """Upload base64-encoded images to ComfyUI."""
-    for img in images:
-        name = img["name"]
-        data = base64.b64decode(img["image"])
-        files = {"image": (name, io.BytesIO(data), "image/png")}
-        body = {"overwrite": "true"}
+class ServerMonitor:
+    """Process-wide readiness latch for ComfyUI.
+
+    A background thread waits once for the server to come up, then keeps a
+    cached healthy/unhealthy state with a cheap periodic probe. Jobs check the
+    latch instead of polling themselves; anything that notices the server going
+    away (e.g. the WebSocket dropping) calls mark_unhealthy() to re-probe now.
+    """
+
+    def __init__(self, url: str = COMFYUI_URL, interval: float = HEALTH_PROBE_INTERVAL, startup_delay: float = 0.05):
+        self.url = url
+        self.interval = interval
+        self.startup_delay = startup_delay
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # When a probe last succeeded (monotonic), 0 if none has
+        self.last_healthy = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="comfy-health", daemon=True)
+                self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until ComfyUI is known-ready or timeout elapses."""
+        return self._ready.wait(timeout)
+
+    def mark_unhealthy(self):
+        self._ready.clear()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            healthy = probe_server(self.url)
+            if healthy:
+                self.last_healthy = time.monotonic()
+                self._ready.set()
+            else:
+                self._ready.clear()
+            self._wake.wait(self.interval if healthy else self.startup_delay)
+            self._wake.clear()
+
+
+server_monitor = ServerMonitor()
+server_monitor.start()
+
+
+class ComfySupervisor:
+    """Run ComfyUI as a child process and restart it whenever it exits.
+
+    Its output is echoed to the worker log and the last few lines are kept.
+    An exit marks the server unhealthy and is recorded with that tail, so
+    jobs it took down fail right away with the reason (see exit_report())
+    instead of waiting out SERVER_WAIT_TIMEOUT. Restarts back off
+    exponentially; the delay resets once ComfyUI has stayed up for
+    max_backoff seconds.
+    """
+
+    def __init__(
+        self,
+        cwd: str = COMFYUI_DIR,
+        args: str = COMFYUI_ARGS,
+        backoff: float = COMFYUI_RESTART_BACKOFF,
+        max_backoff: float = COMFYUI_RESTART_BACKOFF_MAX,
+        tail_lines: int = COMFYUI_LOG_TAIL,
+    ):
+        self.cwd = cwd
+        self.command = [sys.executable, "main.py", *shlex.split(args)]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.restarts = 0
+        self.tail: deque[str] = deque(maxlen=tail_lines)
+        self._proc: subprocess.Popen | None = None
+        self._last_exit: tuple[float, str] | None = None
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="comfy-supervisor", daemon=True)
+                self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+
+    def exit_report(self, since: float, wait: float = 0.0) -> str | None:
+        """Describe a ComfyUI exit seen after `since` (monotonic), waiting up to `wait` seconds for one."""
+        if not self.enabled:
+            return None
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while self._last_exit is None or self._last_exit[0] < since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._last_exit[1]
+
+    def explain(self, error: Exception, since: float) -> str | None:
+        """The exit report behind a failed ComfyUI request, if ComfyUI went down after `since`."""
+        cause = error
+        while cause is not None and not isinstance(cause, (requests.ConnectionError, ConnectionError)):
+            cause = cause.__cause__ or cause.__context__
+        if cause is None:
+            return None
+        # A request can fail a moment before the supervisor sees the exit
+        return self.exit_report(since=since, wait=2.0)
+
+    def _run(self):
+        delay = self.backoff
+        while True:
+            print(f"Starting ComfyUI: {' '.join(self.command)}")
+            started = time.monotonic()
+            try:
+                self._proc = subprocess.Popen(
+                    self.command,
+                    cwd=self.cwd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    errors="replace",
+                )
+                for line in self._proc.stdout:
+                    sys.stdout.write(line)
+                    self.tail.append(line.rstrip())
+                code = self._proc.wait()
+                status = f"ComfyUI exited with code {code}"
+            except OSError as e:
+                status = f"ComfyUI failed to start: {e}"
+            print(f"{status}, restarting in {delay:g}s")
+            report = f"{status}. Last output:\n" + "\n".join(self.tail) if self.tail else status
+
+            server_monitor.mark_unhealthy()
+            with self._cond:
+                self._last_exit = (time.monotonic(), report)
+                self._cond.notify_all()
+            self.restarts += 1
+            metrics.inc("comfyui_restarts_total")
+            metrics.write()
+
+            if time.monotonic() - started >= self.max_backoff:
+                delay = self.backoff
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+            self.tail.clear()
+
+
+comfy_supervisor = ComfySupervisor()
+
+
+_input_index: dict[str, tuple[str, int]] = {}
+_input_index_lock = threading.Lock()
+
+
+def input_is_current(name: str, digest: str, size: int) -> bool:
+    """Check whether ComfyUI's input directory already holds this exact content under name.
+
+    Relies on the per-worker index of previous uploads. When the input
+    directory is reachable, the file must also still exist with the same size.
+    """
+    with _input_index_lock:
+        if _input_index.get(name) != (digest, size):
+            return False
+    if os.path.isdir(COMFYUI_INPUT_DIR):
+        try:
+            return os.path.getsize(os.path.join(COMFYUI_INPUT_DIR, name)) == size
+        except OSError:
+            return False
+    return True
+
+
+def record_input(name: str, digest: str, size: int):
+    """Remember that name in ComfyUI's input directory now holds this content."""
+    with _input_index_lock:
+        _input_index[name] = (digest, size)
+
+
+def upload_image(name: str, data: bytes, url: str = COMFYUI_URL) -> bool:
+    """Upload one image to ComfyUI unless identical content is already there.
+
+    Returns True if the upload was skipped.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if input_is_current(name, digest, len(data)):
+        return True
 
-        resp = requests.post(f"{url}/upload/image", files=files, data=body, timeout=30)
+    files = {"image": (name, data, guess_content_type(name))}
+    body = {"overwrite": "true"}
+    resp = get_client(url).post("/upload/image", files=files, data=body, timeout=30)
+    resp.raise_for_status()
+    record_input(name, digest, len(data))
+    return False
+
+
+_fetch_session = requests.Session()
+_fetch_session.mount("http://", HTTPAdapter(pool_maxsize=UPLOAD_WORKERS))
+_fetch_session.mount("https://", HTTPAdapter(pool_maxsize=UPLOAD_WORKERS))
+
+
+def iter_reference(ref: str, s3_config: dict | None = None):
+    """Stream the bytes behind an http(s):// or s3://bucket/key reference."""
+    if ref.startswith("s3://"):
+        bucket, _, key = ref[len("s3://"):].partition("/")
+        obj = get_s3_client(s3_config).get_object(Bucket=bucket, Key=key)
+        yield from obj["Body"].iter_chunks(FETCH_CHUNK_SIZE)
+        return
+
+    with _fetch_session.get(ref, stream=True, timeout=FETCH_TIMEOUT) as resp:
         resp.raise_for_status()
+        yield from resp.iter_content(chunk_size=FETCH_CHUNK_SIZE)
+
+
+def fetch_input(name: str, ref: str, s3_config: dict | None = None, url: str = COMFYUI_URL) -> str:
+    """Fetch a referenced input image into ComfyUI's input directory.
+
+    Bytes are streamed straight to disk and hashed on the way so the upload
+    index stays accurate. If the input directory isn't reachable from this
+    process the image is buffered and uploaded through the API instead.
+    Returns the content's sha256.
+    """
+    if not os.path.isdir(COMFYUI_INPUT_DIR):
+        data = b"".join(iter_reference(ref, s3_config))
+        upload_image(name, data, url)
+        return hashlib.sha256(data).hexdigest()
+
+    dest = safe_join(COMFYUI_INPUT_DIR, name)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".fetch-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_reference(ref, s3_config):
+                f.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    record_input(name, hasher.hexdigest(), size)
+    return hasher.hexdigest()
+
+
+def upload_images(
+    images: list[dict],
+    url: str = COMFYUI_URL,
+    max_workers: int = UPLOAD_WORKERS,
+    s3_config: dict | None = None,
+    fetched: dict[str, str] | None = None,
+) -> int:
+    """Upload input images to ComfyUI concurrently.
+
+    Inline base64 images are skipped when their content already sits in
+    ComfyUI's input directory; url/s3:// references are fetched by the worker,
+    and their content hashes are stored in `fetched` by name when given.
+    Returns the number of uploads avoided.
+    """
+    if not images:
+        return 0
+
+    def upload(img: dict) -> bool:
+        if "url" in img:
+            digest = fetch_input(img["name"], img["url"], s3_config, url)
+            if fetched is not None:
+                fetched[img["name"]] = digest
+            return False
+        return upload_image(img["name"], base64.b64decode(img["image"]), url)
+
+    workers = max(1, min(max_workers, len(images)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as pool:
+        return sum(pool.map(upload, images))
 
 
 def configure_model_manager(mm_config: dict, url: str = COMFYUI_URL):
     """Configure comfyui-model-manager-nodes with API credentials."""
-    resp = requests.post(
-        f"{url}/model-manager/connect",
+    resp = get_client(url).post(
+        "/model-manager/connect",
         json={"api_url": mm_config["api_url"], "api_key": mm_config["api_key"]},
         timeout=10,
     )
@@ -102,7 +687,8 @@ def configure_model_manager(mm_config: dict, url: str = COMFYUI_URL):
 def queue_workflow(workflow: dict, client_id: str, url: str = COMFYUI_URL) -> str:
     """Submit a workflow to ComfyUI. Returns prompt_id."""
     payload = {"prompt": workflow, "client_id": client_id}
-    resp = requests.post(f"{url}/prompt", json=payload, timeout=30)
+    # Not retried: a reset after the body was sent could queue the prompt twice
+    resp = get_client(url).post("/prompt", json=payload, timeout=30, retry=False)
 
     if resp.status_code != 200:
         try:
@@ -116,55 +702,177 @@ def queue_workflow(workflow: dict, client_id: str, url: str = COMFYUI_URL) -> st
 
 def get_history(prompt_id: str, url: str = COMFYUI_URL) -> dict:
     """Get execution history for a prompt."""
-    resp = requests.get(f"{url}/history/{prompt_id}", timeout=30)
+    resp = get_client(url).get(f"/history/{prompt_id}", timeout=30)
     resp.raise_for_status()
     return resp.json()
 
 
-def get_image(filename: str, subfolder: str, image_type: str, url: str = COMFYUI_URL) -> bytes:
-    """Fetch an output image from ComfyUI."""
+def cancel_prompts(prompt_ids: list[str], running: str | None, url: str = COMFYUI_URL):
+    """Drop prompts from ComfyUI's queue and interrupt the one executing, if it's among them.
+
+    /interrupt stops whatever is executing, so it's only sent when that is one
+    of ours; newer ComfyUI versions also check the prompt_id in the body.
+    Failures are logged, not raised, since this runs while a job is unwinding.
+    """
+    client = get_client(url)
+    try:
+        client.post("/queue", json={"delete": prompt_ids}, timeout=10).raise_for_status()
+        if running in prompt_ids:
+            client.post("/interrupt", json={"prompt_id": running}, timeout=10).raise_for_status()
+            print(f"Interrupted prompt {running}")
+    except requests.RequestException as e:
+        print(f"Failed to cancel prompts {', '.join(prompt_ids)}: {e}")
+
+
+def resolve_local_output(filename: str, subfolder: str, image_type: str) -> str | None:
+    """Map a history entry to a path in ComfyUI's output/temp directory.
+
+    Returns None when the type is unknown or the directory isn't reachable from
+    this process. Raises ValueError if the entry escapes its base directory.
+    """
+    base = {"output": COMFYUI_OUTPUT_DIR, "temp": COMFYUI_TEMP_DIR}.get(image_type)
+    if not base or not os.path.isdir(base):
+        return None
+
+    return safe_join(base, subfolder or "", filename)
+
+
+def safe_join(base: str, *parts: str) -> str:
+    """Join parts onto base, raising ValueError if the result escapes base."""
+    base = os.path.realpath(base)
+    path = os.path.realpath(os.path.join(base, *parts))
+    if os.path.commonpath([base, path]) != base:
+        raise ValueError(f"Path escapes {base}: {os.path.join(*parts)}")
+    return path
+
+
+def open_output(filename: str, subfolder: str, image_type: str, url: str = COMFYUI_URL):
+    """Open an output file for streaming reads; returns (file object, size or None).
+
+    Reads from disk with COMFYUI_LOCAL_OUTPUTS, otherwise streams /view. The
+    caller closes the file object.
+    """
+    if LOCAL_OUTPUTS:
+        path = resolve_local_output(filename, subfolder, image_type)
+        if path is not None:
+            try:
+                f = open(path, "rb")
+                return f, os.fstat(f.fileno()).st_size
+            except (FileNotFoundError, IsADirectoryError):
+                pass
+
     params = urllib.parse.urlencode({
         "filename": filename,
         "subfolder": subfolder,
         "type": image_type,
     })
-    resp = requests.get(f"{url}/view?{params}", timeout=60)
+    resp = get_client(url).get(f"/view?{params}", timeout=60, stream=True)
     resp.raise_for_status()
-    return resp.content
+    resp.raw.decode_content = True
+    length = resp.headers.get("Content-Length", "")
+    return resp.raw, int(length) if length.isdigit() else None
+
+
+def get_image(filename: str, subfolder: str, image_type: str, url: str = COMFYUI_URL) -> bytes:
+    """Fetch an output image from ComfyUI (or from disk, see open_output())."""
+    f, _ = open_output(filename, subfolder, image_type, url)
+    with f:
+        return f.read()
 
 
 # ---------------------------------------------------------------------------
 # S3 upload
 # ---------------------------------------------------------------------------
 
-def upload_to_s3(image_bytes: bytes, filename: str, s3_config: dict) -> str:
-    """Upload image bytes to S3 and return the URL."""
-    s3 = boto3.client(
+_s3_clients: OrderedDict[tuple, object] = OrderedDict()
+_s3_clients_lock = threading.Lock()
+
+_s3_transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_MULTIPART_CONCURRENCY,
+)
+
+
+def get_s3_client(s3_config: dict):
+    """Return a cached S3 client for the given config, creating it on first use.
+
+    Clients are keyed by region, credentials and endpoint so connection pools
+    are reused across images and across jobs on a warm worker. The least
+    recently used client is evicted once the cache is full.
+    """
+    key = (
+        s3_config.get("region", "us-east-1"),
+        s3_config["access_key"],
+        s3_config["secret_key"],
+        s3_config.get("endpoint_url"),
+    )
+    with _s3_clients_lock:
+        client = _s3_clients.get(key)
+        if client is not None:
+            _s3_clients.move_to_end(key)
+            return client
+
+    region, access_key, secret_key, endpoint_url = key
+    client = boto3.client(
         "s3",
-        region_name=s3_config.get("region", "us-east-1"),
-        aws_access_key_id=s3_config["access_key"],
-        aws_secret_access_key=s3_config["secret_key"],
+        region_name=region,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        endpoint_url=endpoint_url,
+        config=BotoConfig(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
     )
 
-    prefix = s3_config.get("prefix", "")
-    key = f"{prefix}{filename}" if prefix else filename
+    with _s3_clients_lock:
+        # Another thread may have raced us; keep whichever landed first
+        client = _s3_clients.setdefault(key, client)
+        _s3_clients.move_to_end(key)
+        while len(_s3_clients) > S3_CLIENT_CACHE_SIZE:
+            _s3_clients.popitem(last=False)
+    return client
+
+
+def s3_object_url(s3_config: dict, key: str) -> str:
+    """Build the public URL for an object, honoring custom S3-compatible endpoints."""
     bucket = s3_config["bucket"]
+    endpoint_url = s3_config.get("endpoint_url")
+    if endpoint_url:
+        return f"{endpoint_url.rstrip('/')}/{bucket}/{key}"
     region = s3_config.get("region", "us-east-1")
+    return f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
+
+
+# Output formats older mimetypes tables don't know
+for _type, _ext in (("image/webp", ".webp"), ("image/avif", ".avif"), ("video/webm", ".webm"), ("audio/flac", ".flac")):
+    mimetypes.add_type(_type, _ext)
 
-    content_type = "image/png"
-    if filename.lower().endswith(".jpg") or filename.lower().endswith(".jpeg"):
-        content_type = "image/jpeg"
-    elif filename.lower().endswith(".webp"):
-        content_type = "image/webp"
-
-    s3.put_object(
-        Bucket=bucket,
-        Key=key,
-        Body=image_bytes,
-        ContentType=content_type,
+
+def guess_content_type(filename: str) -> str:
+    """Guess a MIME type from a filename, defaulting to a generic binary type."""
+    content_type, _ = mimetypes.guess_type(filename)
+    return content_type or "application/octet-stream"
+
+
+def upload_to_s3(image_bytes, filename: str, s3_config: dict, content_type: str | None = None) -> str:
+    """Upload image bytes (or a readable file object) to S3 and return the URL.
+
+    The content type is guessed from the filename unless given. Payloads above
+    S3_MULTIPART_THRESHOLD are sent as a parallel multipart upload.
+    """
+    s3 = get_s3_client(s3_config)
+
+    prefix = s3_config.get("prefix", "")
+    key = f"{prefix}{filename}" if prefix else filename
+
+    s3.upload_fileobj(
+        io.BytesIO(image_bytes) if isinstance(image_bytes, bytes) else image_bytes,
+        s3_config["bucket"],
+        key,
+        ExtraArgs={"ContentType": content_type or guess_content_type(filename)},
+        Config=_s3_transfer_config,
     )
 
-    return f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
+    return s3_object_url(s3_config, key)
 
 
 # ---------------------------------------------------------------------------
@@ -206,44 +914,1277 @@ def wait_for_completion(ws, prompt_id: str, timeout: int = 600) -> bool:
         ws.close()
 
 
+# Delivered to every subscriber when the shared WebSocket drops
+CONNECTION_LOST = {"type": "connection_lost", "data": {}}
+
+# Binary WebSocket event types sent by ComfyUI
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+
+
+def parse_preview(message: bytes) -> tuple[dict, bytes] | None:
+    """Split a binary preview frame into (metadata, encoded image), or None if it isn't one.
+
+    Plain previews carry no metadata; newer ComfyUI versions prefix the image
+    with JSON naming its node_id and prompt_id.
+    """
+    if len(message) < 8:
+        return None
+    event_type = int.from_bytes(message[:4], "big")
+    if event_type == PREVIEW_IMAGE:
+        return {}, message[8:]
+    if event_type == PREVIEW_IMAGE_WITH_METADATA:
+        length = int.from_bytes(message[4:8], "big")
+        try:
+            metadata = json.loads(message[8:8 + length])
+        except ValueError:
+            return None
+        return metadata if isinstance(metadata, dict) else {}, message[8 + length:]
+    return None
+
+
+# Prompts whose early events are buffered until their job subscribes
+PENDING_PROMPTS_LIMIT = 64
+
+
+class EventHub:
+    """One shared ComfyUI WebSocket, demultiplexed to jobs by prompt_id.
+
+    A reader thread parses each message once and routes it to the queue of the
+    job that owns the prompt. Events that arrive before the job subscribes
+    (between /prompt returning and subscribe()) are buffered. Binary preview
+    frames carry no prompt_id and go to whichever prompt is executing.
+    """
+
+    def __init__(self, url: str = COMFYUI_URL, client_id: str | None = None):
+        self.url = url
+        self.client_id = client_id or str(uuid.uuid4())
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, queue.Queue] = {}
+        self._pending: OrderedDict[str, list] = OrderedDict()
+        self._running: str | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self, timeout: int = 10):
+        """Connect the shared WebSocket unless it's already up. Raises on failure."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            ws = connect_ws(self.client_id, self.url, timeout=timeout)
+            ws.settimeout(None)
+            self._thread = threading.Thread(target=self._run, args=(ws,), name="comfy-ws", daemon=True)
+            self._thread.start()
+
+    def subscribe(self, prompt_id: str, events: queue.Queue | None = None) -> queue.Queue:
+        """Route every event for prompt_id, including any already buffered, to a queue.
+
+        Items are (prompt_id, event) tuples, so several prompts can share one
+        queue. Returns the queue (a new one unless passed in).
+        """
+        events = events if events is not None else queue.Queue()
+        with self._lock:
+            for event in self._pending.pop(prompt_id, []):
+                events.put((prompt_id, event))
+            self._subscribers[prompt_id] = events
+        return events
+
+    @property
+    def running(self) -> str | None:
+        """The prompt ComfyUI is executing, as last reported on the WebSocket."""
+        return self._running
+
+    def unsubscribe(self, prompt_id: str):
+        with self._lock:
+            self._subscribers.pop(prompt_id, None)
+            self._pending.pop(prompt_id, None)
+
+    def _run(self, ws):
+        try:
+            while True:
+                self._dispatch(ws.recv())
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._running = None
+                subscribers = list(self._subscribers.values())
+            for events in set(subscribers):
+                events.put((None, CONNECTION_LOST))
+            ws.close()
+            server_monitor.mark_unhealthy()
+
+    def _dispatch(self, message):
+        if isinstance(message, bytes):
+            preview = parse_preview(message)
+            if preview is None:
+                return
+            prompt_id = preview[0].get("prompt_id") or self._running
+            event = preview
+        else:
+            event = json.loads(message)
+            exec_data = event.get("data") or {}
+            prompt_id = exec_data.get("prompt_id") if isinstance(exec_data, dict) else None
+            msg_type = event.get("type")
+            if msg_type == "execution_start":
+                self._running = prompt_id
+            elif msg_type in ("execution_success", "execution_error", "execution_interrupted") and prompt_id == self._running:
+                self._running = None
+
+        if prompt_id is None:
+            return
+
+        with self._lock:
+            events = self._subscribers.get(prompt_id)
+            if events is None:
+                self._pending.setdefault(prompt_id, []).append(event)
+                while len(self._pending) > PENDING_PROMPTS_LIMIT:
+                    self._pending.popitem(last=False)
+                return
+        events.put((prompt_id, event))
+
+
+_hubs: dict[str, EventHub] = {}
+
+
+def get_hub(url: str = COMFYUI_URL) -> EventHub:
+    """Return the shared EventHub for a server URL."""
+    with _clients_lock:
+        hub = _hubs.get(url)
+        if hub is None:
+            hub = _hubs[url] = EventHub(url)
+        return hub
+
+
 # ---------------------------------------------------------------------------
-# Output collection
+# Timing and metrics
 # ---------------------------------------------------------------------------
 
-def collect_outputs(prompt_id: str, s3_config: dict | None = None, url: str = COMFYUI_URL) -> list[dict]:
-    """Collect output images from a completed workflow."""
-    history = get_history(prompt_id, url)
-    prompt_history = history.get(prompt_id, {})
-    outputs = prompt_history.get("outputs", {})
+class JobTiming:
+    """Monotonic per-phase and per-node timings and counters for one job.
 
-    results = []
+    Phases accumulate, so work spread over worker threads (e.g. output_fetch
+    across several outputs) sums up rather than overwriting.
+    """
 
-    for node_id, node_output in outputs.items():
-        images = node_output.get("images", [])
-        for img_info in images:
-            filename = img_info["filename"]
-            subfolder = img_info.get("subfolder", "")
-            img_type = img_info.get("type", "output")
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.nodes: list[dict] = []
+        self._lock = threading.Lock()
 
-            image_bytes = get_image(filename, subfolder, img_type, url)
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
 
-            if s3_config:
-                s3_url = upload_to_s3(image_bytes, filename, s3_config)
-                results.append({"filename": filename, "url": s3_url})
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def node(
+        self,
+        node_id: str,
+        class_type: str,
+        seconds: float,
+        cached: bool = False,
+        batch_index: int | None = None,
+    ):
+        entry = {"node": node_id, "class_type": class_type, "seconds": round(seconds, 3), "cached": cached}
+        if batch_index is not None:
+            entry["batch_index"] = batch_index
+        with self._lock:
+            self.nodes.append(entry)
+
+    def total(self) -> float:
+        return time.monotonic() - self.started
+
+    def as_dict(self) -> dict:
+        """The breakdown returned with a job's final result."""
+        with self._lock:
+            out = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+            out.update(self.counts)
+            if self.nodes:
+                out["nodes"] = list(self.nodes)
+        out["total"] = round(self.total(), 3)
+        return out
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Exported metrics: name -> (type, help)
+METRICS_HELP = {
+    "comfyui_jobs_total": ("counter", "Jobs finished, by outcome and result cache status."),
+    "comfyui_job_seconds": ("histogram", "Wall time of a job, by outcome."),
+    "comfyui_phase_seconds": ("histogram", "Time spent in each job phase."),
+    "comfyui_node_seconds": ("histogram", "Execution time of non-cached nodes, by class type."),
+    "comfyui_nodes_cached_total": ("counter", "Nodes ComfyUI served from its cache, by class type."),
+    "comfyui_input_bytes_total": ("counter", "Input image bytes handed to ComfyUI."),
+    "comfyui_output_bytes_total": ("counter", "Output bytes delivered, by delivery method."),
+    "comfyui_outputs_total": ("counter", "Outputs delivered, by delivery method."),
+    "comfyui_uploads_skipped_total": ("counter", "Input uploads skipped because ComfyUI already had the content."),
+    "comfyui_restarts_total": ("counter", "Times the supervised ComfyUI process exited and was restarted."),
+}
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metrics:
+    """Rolling per-worker aggregates of job timings, rendered in Prometheus text format."""
+
+    def __init__(self, path: str = METRICS_FILE, buckets: tuple = METRICS_BUCKETS):
+        self.path = path
+        self.buckets = buckets
+        self._counters: dict[str, dict[tuple, float]] = {}
+        # Per series: cumulative-ready bucket counts, then sum and count
+        self._histograms: dict[str, dict[tuple, list]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def record_job(self, timing: JobTiming, outcome: str, cache: str | None = None):
+        """Fold one finished job into the aggregates and rewrite the metrics file."""
+        self.inc("comfyui_jobs_total", outcome=outcome, cache=cache or "none")
+        self.observe("comfyui_job_seconds", timing.total(), outcome=outcome)
+        with timing._lock:
+            phases = dict(timing.phases)
+            counts = dict(timing.counts)
+            nodes = list(timing.nodes)
+        for phase, seconds in phases.items():
+            self.observe("comfyui_phase_seconds", seconds, phase=phase)
+        for node in nodes:
+            if node["cached"]:
+                self.inc("comfyui_nodes_cached_total", class_type=node["class_type"])
             else:
-                b64 = base64.b64encode(image_bytes).decode("utf-8")
-                results.append({"filename": filename, "data": b64})
+                self.observe("comfyui_node_seconds", node["seconds"], class_type=node["class_type"])
+        if counts.get("input_bytes"):
+            self.inc("comfyui_input_bytes_total", counts["input_bytes"])
+        if counts.get("uploads_skipped"):
+            self.inc("comfyui_uploads_skipped_total", counts["uploads_skipped"])
+        for delivery in ("inline", "s3", "chunked"):
+            if counts.get(f"outputs_{delivery}"):
+                self.inc("comfyui_outputs_total", counts[f"outputs_{delivery}"], delivery=delivery)
+                self.inc("comfyui_output_bytes_total", counts[f"output_bytes_{delivery}"], delivery=delivery)
+        self.write()
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS_HELP.items():
+                series = (self._counters if kind == "counter" else self._histograms).get(name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    if kind == "counter":
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                        continue
+                    for bound, count in zip(self.buckets, value):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Atomically replace the metrics file with the current aggregates."""
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Failed to write metrics to {self.path}: {e}")
+
+    def serve(self, port: int):
+        """Serve /metrics over HTTP on a background thread."""
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsRequestHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on :{port}/metrics")
+
+
+metrics = Metrics()
+
+
+class JobProfiler:
+    """Profile of the thread running one job: cProfile stats plus sampled stacks.
+
+    The deterministic profile only runs while the job's generator is advancing
+    (see step()); the sampler records wall-clock stacks, waits included, in
+    collapsed format for flame graphs. Output collection runs on worker threads
+    and is only visible through the output_* phases in timing.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.profile: cProfile.Profile | None = cProfile.Profile()
+        self.stacks: dict[str, int] = {}
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def step(self, gen):
+        """Advance the job's generator under the profiler; None once it's exhausted."""
+        if self.profile is None:
+            return next(gen, None)
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one cProfile at a time; concurrent jobs keep only their samples
+            self.profile = None
+            return next(gen, None)
+        try:
+            return next(gen, None)
+        finally:
+            self.profile.disable()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def save(self, job_id: str, timing: JobTiming, s3_config: dict | None = None) -> dict:
+        """Write the profile and the job's timing; returns where each file went.
+
+        Files are uploaded under profiles/ in the job's S3 prefix when it has
+        an s3 config, otherwise written to PROFILE_DIR.
+        """
+        files = {
+            "timing": (f"{job_id}.timing.json", json.dumps(timing.as_dict(), indent=2).encode()),
+            "collapsed": (
+                f"{job_id}.collapsed",
+                "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items())).encode(),
+            ),
+        }
+        if self.profile is not None:
+            buf = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=buf)
+            stats.sort_stats("cumulative").print_stats(40)
+            files["summary"] = (f"{job_id}.txt", buf.getvalue().encode())
+            with tempfile.NamedTemporaryFile(suffix=".pstats") as f:
+                stats.dump_stats(f.name)
+                files["pstats"] = (f"{job_id}.pstats", Path(f.name).read_bytes())
+
+        refs = {}
+        if s3_config:
+            for kind, (name, data) in files.items():
+                refs[kind] = upload_to_s3(data, f"profiles/{name}", s3_config, "application/octet-stream")
+            return refs
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        for kind, (name, data) in files.items():
+            path = safe_join(PROFILE_DIR, name)
+            Path(path).write_bytes(data)
+            refs[kind] = path
+        return refs
+
+
+# ---------------------------------------------------------------------------
+# Output collection
+# ---------------------------------------------------------------------------
+
+def encode_image(image: Image.Image, fmt: str, quality: int | None, max_dimension: int | None) -> bytes:
+    """Encode a decoded image in an output format, shrinking it to fit max_dimension."""
+    if max_dimension and max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    params = {"quality": quality} if quality is not None and fmt != "png" else {}
+    buf = io.BytesIO()
+    image.save(buf, OUTPUT_FORMATS[fmt], **params)
+    return buf.getvalue()
+
+
+def transcode_output(data: bytes, filename: str, output_format: dict) -> list[tuple[str, bytes, str]]:
+    """Apply output_format to an output file.
+
+    Returns (filename, bytes, content_type) for the full asset, followed by
+    its thumbnail when one was requested. Files Pillow can't decode and
+    animations (which would lose every frame but the first) pass through
+    untouched.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except UnidentifiedImageError:
+        return [(filename, data, guess_content_type(filename))]
+    if getattr(image, "is_animated", False):
+        return [(filename, data, guess_content_type(filename))]
+
+    fmt = output_format.get("format", "png")
+    quality = output_format.get("quality")
+    stem = os.path.splitext(filename)[0]
+    content_type = Image.MIME.get(OUTPUT_FORMATS[fmt], guess_content_type(filename))
+
+    files = [(f"{stem}.{fmt}", encode_image(image, fmt, quality, output_format.get("max_dimension")), content_type)]
+    if output_format.get("thumbnail"):
+        thumb = encode_image(image, fmt, quality, output_format["thumbnail"])
+        files.append((f"{stem}_thumb.{fmt}", thumb, content_type))
+    return files
+
+
+class InlineBudget:
+    """How many output bytes a job may still return inline as base64."""
+
+    def __init__(self, per_output: int = INLINE_OUTPUT_BYTES, total: int = INLINE_TOTAL_BYTES):
+        self.per_output = per_output
+        self.remaining = total
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int) -> bool:
+        """Claim room for an output of this size; False if it has to go elsewhere."""
+        with self._lock:
+            if size > self.per_output or size > self.remaining:
+                return False
+            self.remaining -= size
+            return True
+
+
+def deliver(
+    filename: str,
+    source,
+    size: int,
+    content_type: str | None,
+    s3_config: dict | None,
+    budget: InlineBudget | None = None,
+    timing: JobTiming | None = None,
+) -> dict:
+    """Route one output to S3, inline base64, or sequenced stream parts.
+
+    `source` is a callable returning a readable file object. An output that
+    doesn't fit the budget goes to the offload bucket when there is one;
+    otherwise the result carries the source under "_source" so output_chunks()
+    can stream it a part at a time when it's emitted.
+    """
+    timing = timing or JobTiming()
+    content_type = content_type or guess_content_type(filename)
+    if not s3_config and budget is not None and not budget.reserve(size):
+        s3_config = OFFLOAD_S3_CONFIG
+        if not s3_config:
+            timing.count("outputs_chunked")
+            timing.count("output_bytes_chunked", size)
+            parts = max(1, -(-size // OUTPUT_PART_BYTES))
+            return {
+                "filename": filename,
+                "content_type": content_type,
+                "size": size,
+                "parts": parts,
+                "chunked": True,
+                "_source": source,
+            }
+    delivery = "s3" if s3_config else "inline"
+    timing.count(f"outputs_{delivery}")
+    timing.count(f"output_bytes_{delivery}", size)
+    with source() as f:
+        if s3_config:
+            # Streamed outputs are read from ComfyUI while they upload, so this includes the fetch
+            with timing.phase("output_upload"):
+                url = upload_to_s3(f, filename, s3_config, content_type)
+            return {"filename": filename, "content_type": content_type, "url": url}
+        with timing.phase("output_fetch"):
+            data = f.read()
+        with timing.phase("output_encode"):
+            encoded = base64.b64encode(data).decode("utf-8")
+        return {"filename": filename, "content_type": content_type, "size": size, "data": encoded}
+
+
+def deliver_bytes(
+    filename: str,
+    data: bytes,
+    content_type: str | None,
+    s3_config: dict | None,
+    budget: InlineBudget | None = None,
+    timing: JobTiming | None = None,
+) -> dict:
+    return deliver(filename, lambda: io.BytesIO(data), len(data), content_type, s3_config, budget, timing)
+
+
+def collect_output(
+    img_info: dict,
+    s3_config: dict | None = None,
+    url: str = COMFYUI_URL,
+    output_format: dict | None = None,
+    budget: InlineBudget | None = None,
+    kind: str = "images",
+    timing: JobTiming | None = None,
+) -> dict:
+    """Fetch a single output file and either upload it to S3 or base64-encode it.
+
+    With an output_format an image is transcoded first, and a requested
+    thumbnail is returned alongside it under "thumbnail". Only entries from
+    a node's "images" key are transcoded; videos, GIFs and audio are streamed
+    as-is. With a budget, outputs that don't fit it are offloaded or chunked
+    (see deliver()). Fetch, encode and upload times are added to timing.
+    """
+    timing = timing or JobTiming()
+    filename = img_info["filename"]
+    subfolder = img_info.get("subfolder", "")
+    img_type = img_info.get("type", "output")
+
+    if output_format and kind == "images":
+        with timing.phase("output_fetch"):
+            image_bytes = get_image(filename, subfolder, img_type, url)
+        with timing.phase("output_transcode"):
+            files = transcode_output(image_bytes, filename, output_format)
+        del image_bytes
+        result = deliver_bytes(*files[0], s3_config, budget, timing)
+        if len(files) > 1:
+            result["thumbnail"] = deliver_bytes(*files[1], s3_config, budget, timing)
+        return result
+
+    with timing.phase("output_fetch"):
+        f, size = open_output(filename, subfolder, img_type, url)
+        if size is None:
+            # No length to route on; read it to find out
+            with f:
+                data = f.read()
+    if size is None:
+        return deliver_bytes(filename, data, None, s3_config, budget, timing)
+
+    # The already-open stream serves the first read; a chunked output reopens later
+    pending = [f]
+
+    def source():
+        return pending.pop() if pending else open_output(filename, subfolder, img_type, url)[0]
+
+    try:
+        return deliver(filename, source, size, None, s3_config, budget, timing)
+    finally:
+        if pending:
+            pending.pop().close()
+
+
+class OutputCollector:
+    """Fetch and encode/upload outputs in the background as nodes finish.
+
+    Work runs on a bounded worker pool; results are handed back in the order the
+    outputs were submitted, regardless of which finishes first.
+    """
+
+    def __init__(
+        self,
+        s3_config: dict | None = None,
+        url: str = COMFYUI_URL,
+        max_workers: int = OUTPUT_WORKERS,
+        output_format: dict | None = None,
+        budget: InlineBudget | None = None,
+        timing: JobTiming | None = None,
+    ):
+        self.s3_config = s3_config
+        self.url = url
+        self.output_format = output_format
+        self.budget = budget
+        self.timing = timing
+        self.nodes: set[str] = set()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="collect")
+        self._futures: list[Future] = []
+        self._seen: set[tuple[str, str, str]] = set()
+        self._emitted = 0
+
+    def submit(self, node_id: str, node_output: dict, tags: dict | None = None):
+        """Queue every file reported by a node's output for collection.
+
+        Any key holding a list of file entries counts: images, gifs, videos,
+        audio and whatever else custom nodes report. Keys in tags (e.g.
+        batch_index) are added to each result.
+        """
+        self.nodes.add(node_id)
+        for kind, entries in node_output.items():
+            if not isinstance(entries, list):
+                continue
+            for file_info in entries:
+                if not isinstance(file_info, dict) or "filename" not in file_info:
+                    continue
+                key = (file_info["filename"], file_info.get("subfolder", ""), file_info.get("type", "output"))
+                if key in self._seen:
+                    continue
+                self._seen.add(key)
+                self._futures.append(self._pool.submit(self._collect, file_info, kind, tags))
+
+    def _collect(self, file_info: dict, kind: str, tags: dict | None) -> dict:
+        result = collect_output(
+            file_info, self.s3_config, self.url, self.output_format, self.budget, kind, self.timing
+        )
+        return {**result, **tags} if tags else result
+
+    def submit_history(self, prompt_id: str, tags: dict | None = None):
+        """Queue every output recorded in a finished prompt's /history entry."""
+        outputs = get_history(prompt_id, self.url).get(prompt_id, {}).get("outputs", {})
+        for node_id, node_output in outputs.items():
+            self.submit(node_id, node_output, tags)
+
+    def ready(self) -> list[dict]:
+        """Return results completed since the last call, stopping at the first pending one."""
+        results = []
+        while self._emitted < len(self._futures) and self._futures[self._emitted].done():
+            results.append(self._futures[self._emitted].result())
+            self._emitted += 1
+        return results
+
+    def drain(self):
+        """Yield the remaining results in order, waiting for each to finish."""
+        while self._emitted < len(self._futures):
+            result = self._futures[self._emitted].result()
+            self._emitted += 1
+            yield result
+
+    def results(self) -> list[dict]:
+        """Wait for and return every result, in submission order."""
+        return [future.result() for future in self._futures]
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def output_metadata(result: dict) -> dict:
+    """A collected output without its inline data (or its thumbnail's)."""
+    entry = {k: v for k, v in result.items() if k != "data"}
+    if "thumbnail" in result:
+        entry["thumbnail"] = output_metadata(result["thumbnail"])
+    return entry
+
+
+def output_chunk(result: dict) -> dict:
+    """Build the stream chunk announcing a single collected output.
+
+    Inline data is left to the final result, so the chunk carries only the
+    output's metadata and the aggregated stream holds each file once.
+    """
+    chunk = {"status": "output", "message": f"Collected {result['filename']}", "image": output_metadata(result)}
+    if "batch_index" in result:
+        chunk["batch_index"] = result["batch_index"]
+    return chunk
+
+
+def preview_chunk(image: bytes, node: str | None) -> dict | None:
+    """Downscale a latent preview frame into a small JPEG stream chunk."""
+    try:
+        frame = Image.open(io.BytesIO(image))
+        frame.thumbnail((PREVIEW_MAX_DIMENSION, PREVIEW_MAX_DIMENSION))
+        buf = io.BytesIO()
+        frame.convert("RGB").save(buf, "JPEG", quality=70)
+    except (UnidentifiedImageError, OSError):
+        return None
+    return {
+        "status": "preview",
+        "node": node,
+        "preview": {"content_type": "image/jpeg", "data": base64.b64encode(buf.getvalue()).decode("utf-8")},
+    }
+
+
+class Throttle:
+    """Coalesce a stream of updates: at most one per interval, always the latest."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.pending = None
+        self._last = 0.0
+
+    def offer(self, item):
+        self.pending = item
+
+    def take(self):
+        """Return the pending update if the interval has passed, else None."""
+        if self.pending is None or time.monotonic() - self._last < self.interval:
+            return None
+        item, self.pending = self.pending, None
+        self._last = time.monotonic()
+        return item
+
+    def clear(self):
+        self.pending = None
+
+
+def output_chunks(result: dict):
+    """Yield the stream chunks for one collected output.
+
+    A chunked output is streamed first as output_part chunks, reading one part
+    at a time from its source, then announced like any other output.
+    """
+    source = result.pop("_source", None)
+    if source is not None:
+        with source() as f:
+            for part in range(result["parts"]):
+                data = b""
+                want = min(OUTPUT_PART_BYTES, result["size"] - part * OUTPUT_PART_BYTES)
+                while len(data) < want and (block := f.read(want - len(data))):
+                    data += block
+                if len(data) < want:
+                    raise RuntimeError(f"{result['filename']} ended after part {part}")
+                chunk = {
+                    "status": "output_part",
+                    "filename": result["filename"],
+                    "part": part,
+                    "parts": result["parts"],
+                    "data": base64.b64encode(data).decode("utf-8"),
+                }
+                if "batch_index" in result:
+                    chunk["batch_index"] = result["batch_index"]
+                yield chunk
+    yield output_chunk(result)
+
+
+# ---------------------------------------------------------------------------
+# On-demand models
+# ---------------------------------------------------------------------------
+
+class ModelCache:
+    """Fetches catalog models that workflows reference and keeps them under a disk budget.
+
+    Only models fetched here are tracked and evicted, least recently used
+    first; models from config/models.yaml or the network volume are never
+    touched. Recency lives in an index file next to the models, since a
+    model's mtime is what the downloader's lockfile checks.
+    """
+
+    def __init__(self, catalog_path: str = MODELS_CATALOG, max_bytes: int = MODEL_CACHE_BYTES):
+        self.models_dir = Path(os.environ.get("COMFYUI_MODELS_DIR", os.path.join(COMFYUI_DIR, "models")))
+        self.max_bytes = max_bytes
+        self.index_path = self.models_dir / "models.on_demand.json"
+        self.extra_roots = download_models.load_extra_roots(
+            Path(os.environ.get("EXTRA_MODEL_PATHS", os.path.join(COMFYUI_DIR, "extra_model_paths.yaml")))
+        )
+        self.lock = download_models.Lockfile(self.models_dir / download_models.LOCKFILE_NAME)
+        self.catalog = {}
+        if os.path.exists(catalog_path):
+            with open(catalog_path) as f:
+                config = yaml.safe_load(f) or {}
+            for _, url, dest_subdir, filename, sha256, size in download_models.iter_manifest(config):
+                # Workflows name models relative to their folder, e.g. "sdxl/foo.safetensors" under loras/
+                name = Path(*Path(dest_subdir).parts[1:], filename).as_posix()
+                self.catalog[name] = {"url": url, "dest": dest_subdir, "filename": filename, "sha256": sha256, "size": size}
+        self._lock = threading.Lock()
+        self._fetches: dict[str, Future] = {}
+        self._progress: dict[str, tuple[int, int]] = {}
+        self._pool = ThreadPoolExecutor(max_workers=download_models.DOWNLOAD_CONCURRENCY, thread_name_prefix="model")
+        try:
+            self._index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            self._index = {}
+
+    def referenced(self, workflows: list[dict]) -> set[str]:
+        """Catalog models named by any node input (ckpt_name, lora_name, clip_name1, ...)."""
+        names = set()
+        for wf in workflows:
+            for node in wf.values():
+                for value in node.get("inputs", {}).values():
+                    if isinstance(value, str) and value in self.catalog:
+                        names.add(value)
+        return names
+
+    def _present(self, name: str) -> bool:
+        entry = self.catalog[name]
+        candidates = download_models.locate(entry["dest"], entry["filename"], self.models_dir, self.extra_roots)
+        return any(path.is_file() for path, _, _ in candidates)
+
+    def missing(self, workflows: list[dict]) -> list[str]:
+        return sorted(name for name in self.referenced(workflows) if not self._present(name))
+
+    def touch(self, names, hold: float = MODEL_EVICT_GRACE):
+        """Mark on-demand models as just used and keep them from eviction for `hold` seconds."""
+        now = time.time()
+        with self._lock:
+            entries = [self._index[name] for name in names if name in self._index]
+            for entry in entries:
+                entry["last_used"] = now
+                entry["held_until"] = max(entry.get("held_until", 0), now + hold)
+            if entries:
+                self._save()
+
+    def fetch(self, name: str) -> Future:
+        """Start downloading a catalog model; concurrent jobs share one download."""
+        with self._lock:
+            future = self._fetches.get(name)
+            if future is None:
+                future = self._pool.submit(self._download, name)
+                self._fetches[name] = future
+                future.add_done_callback(lambda _: self._forget(name))
+            return future
+
+    def _forget(self, name: str):
+        with self._lock:
+            self._fetches.pop(name, None)
+            self._progress.pop(name, None)
+
+    def progress(self, names) -> tuple[int, int]:
+        """Total (downloaded, expected) bytes across in-flight downloads."""
+        with self._lock:
+            done = sum(self._progress.get(name, (0, 0))[0] for name in names)
+            total = sum(self._progress.get(name, (0, self.catalog[name]["size"] or 0))[1] for name in names)
+        return done, total
+
+    def _download(self, name: str):
+        entry = self.catalog[name]
+        headers = download_models.auth_headers()
+        size = entry["size"]
+        if size is None:
+            _, size, _ = download_models.probe(entry["url"], headers)
+        self._evict(size, keep=name)
+
+        def on_progress(downloaded: int, total: int):
+            with self._lock:
+                self._progress[name] = (downloaded, total)
+
+        dest = self.models_dir / entry["dest"] / entry["filename"]
+        download_models.download_file(
+            entry["url"], dest, headers, sha256=entry["sha256"], size=entry["size"], lock=self.lock, progress=on_progress
+        )
+        with self._lock:
+            self._index[name] = {"path": str(dest), "size": dest.stat().st_size, "last_used": time.time()}
+            self._save()
+
+    def _evict(self, needed: int, keep: str):
+        """Delete least recently used on-demand models until `needed` more bytes fit the budget."""
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            used = sum(entry["size"] for entry in self._index.values())
+            now = time.time()
+            for name, entry in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+                if used + needed <= self.max_bytes:
+                    break
+                held_until = entry.get("held_until", entry["last_used"] + MODEL_EVICT_GRACE)
+                if name == keep or name in self._fetches or held_until > now:
+                    continue
+                try:
+                    os.unlink(entry["path"])
+                except FileNotFoundError:
+                    pass
+                print(f"Evicted on-demand model {name}")
+                used -= entry["size"]
+                del self._index[name]
+            self._save()
+
+    def _save(self):
+        """Persist the index (caller holds the lock)."""
+        tmp = self.index_path.with_suffix(".json.new")
+        try:
+            self.models_dir.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(self._index))
+            tmp.replace(self.index_path)
+        except OSError:
+            pass
+
+
+model_cache = ModelCache()
+
+
+# ---------------------------------------------------------------------------
+# Preflight
+# ---------------------------------------------------------------------------
+
+class ObjectInfoCache:
+    """Snapshot of ComfyUI's /object_info, refetched only when it could have changed.
+
+    Node definitions change when custom node packs are added or removed, and
+    model combo lists change when a model folder does, so the snapshot is
+    keyed on the mtimes of custom_nodes/ and each model folder (checkpoints/,
+    loras/, ...). Checking those costs a few stat calls instead of a full
+    refetch; files added in a folder's subdirectories may go unnoticed until
+    then, which only matters to the combo lists ComfyUI reports.
+    """
+
+    def __init__(self, url: str = COMFYUI_URL):
+        self.url = url
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._info = None
+
+    def model_dirs(self) -> list[str]:
+        """The folder directories ComfyUI loads models from."""
+        dirs = []
+        try:
+            with os.scandir(model_cache.models_dir) as entries:
+                dirs += sorted(e.path for e in entries if e.is_dir())
+        except OSError:
+            pass
+        for _, folders in model_cache.extra_roots:
+            dirs += [str(directory) for paths in folders.values() for directory in paths]
+        return dirs
+
+    def fingerprint(self) -> tuple:
+        stamps = []
+        custom_nodes = os.path.join(COMFYUI_DIR, "custom_nodes")
+        try:
+            with os.scandir(custom_nodes) as entries:
+                stamps += sorted((e.name, e.stat().st_mtime_ns) for e in entries)
+        except OSError:
+            pass
+        for directory in self.model_dirs():
+            try:
+                stamps.append((directory, os.stat(directory).st_mtime_ns))
+            except OSError:
+                continue
+        return tuple(stamps)
+
+    def get(self) -> dict:
+        fingerprint = self.fingerprint()
+        with self._lock:
+            if self._info is None or fingerprint != self._fingerprint:
+                resp = get_client(self.url).get("/object_info", timeout=30)
+                resp.raise_for_status()
+                self._info = resp.json()
+                self._fingerprint = fingerprint
+            return self._info
+
+
+object_info = ObjectInfoCache()
+
+
+# File extensions ComfyUI treats as models (folder_paths.supported_pt_extensions)
+MODEL_EXTENSIONS = (".ckpt", ".pt", ".pt2", ".bin", ".pth", ".safetensors", ".pkl", ".sft", ".gguf")
+
+
+def _combo_options(spec) -> list | None:
+    """The allowed values of a combo input spec, or None if it isn't a combo.
+
+    Combos that accept uploads (LoadImage and friends) are skipped: files
+    uploaded since the snapshot was taken wouldn't be in the list.
+    """
+    if not isinstance(spec, (list, tuple)) or not spec:
+        return None
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if any(key.endswith("_upload") or key == "upload" for key in options):
+        return None
+    if isinstance(spec[0], list):
+        return spec[0]
+    if spec[0] == "COMBO" and isinstance(options.get("options"), list):
+        return options["options"]
+    return None
+
+
+def _types_match(output_type, input_type) -> bool:
+    if not isinstance(output_type, str) or not isinstance(input_type, str):
+        return True
+    if "*" in (output_type, input_type):
+        return True
+    return bool(set(output_type.split(",")) & set(input_type.split(",")))
+
+
+def preflight(workflow: dict, info: dict, check_values: bool = True, model_dirs: list[str] = ()) -> list[str]:
+    """Check a workflow against /object_info the way ComfyUI's /prompt would.
+
+    Returns a list of problems: unknown node types, missing required inputs,
+    links to missing nodes or outputs (or of the wrong type), and model
+    filenames that aren't in any of `model_dirs`. Empty means it looks
+    runnable. Other combo values outside the snapshot's list are left to
+    /prompt, since nodes with VALIDATE_INPUTS accept values ComfyUI never
+    listed.
+    """
+    problems = []
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or "class_type" not in node:
+            problems.append(f"node {node_id} has no class_type")
+            continue
+        class_type = node["class_type"]
+        definition = info.get(class_type)
+        if definition is None:
+            problems.append(f"node {node_id}: unknown node type '{class_type}'")
+            continue
+
+        inputs = node.get("inputs", {})
+        spec_inputs = definition.get("input", {})
+        required = spec_inputs.get("required", {})
+        optional = spec_inputs.get("optional", {})
+        for name in required:
+            if name not in inputs:
+                problems.append(f"node {node_id} ({class_type}): missing required input '{name}'")
+
+        for name, value in inputs.items():
+            spec = required.get(name) or optional.get(name)
+            if spec is None:
+                continue
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[1], int):
+                source_id = str(value[0])
+                source = workflow.get(source_id)
+                if not isinstance(source, dict):
+                    problems.append(f"node {node_id} ({class_type}): input '{name}' links to missing node {source_id}")
+                    continue
+                outputs = info.get(source.get("class_type"), {}).get("output")
+                if outputs is None:
+                    continue
+                if not 0 <= value[1] < len(outputs):
+                    problems.append(
+                        f"node {node_id} ({class_type}): input '{name}' links to output {value[1]} "
+                        f"of node {source_id}, which has {len(outputs)}"
+                    )
+                elif not _types_match(outputs[value[1]], spec[0] if isinstance(spec, (list, tuple)) else None):
+                    problems.append(
+                        f"node {node_id} ({class_type}): input '{name}' expects {spec[0]}, "
+                        f"but node {source_id} output {value[1]} is {outputs[value[1]]}"
+                    )
+            elif check_values:
+                options = _combo_options(spec)
+                if (
+                    options is not None
+                    and value not in options
+                    and isinstance(value, str)
+                    and value.lower().endswith(MODEL_EXTENSIONS)
+                    and not any(os.path.isfile(os.path.join(d, value)) for d in model_dirs)
+                ):
+                    problems.append(f"node {node_id} ({class_type}): '{value}' is not an available {name}")
+    return problems
+
+
+# ---------------------------------------------------------------------------
+# Result cache
+# ---------------------------------------------------------------------------
+
+def _normalize(value):
+    """Normalize workflow values so equivalent graphs serialize identically."""
+    if isinstance(value, dict):
+        # _meta only carries UI titles and doesn't affect execution
+        return {k: _normalize(v) for k, v in value.items() if k != "_meta"}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def result_cache_key(
+    workflows: list[dict],
+    input_digests: dict[str, str],
+    s3_config: dict | None,
+    output_format: dict | None = None,
+) -> str:
+    """Hash the canonical form of everything that determines a job's results.
+
+    S3 results are keyed on their destination too, so URLs are only ever
+    returned to jobs writing to the same bucket and prefix.
+    """
+    destination = None
+    if s3_config:
+        destination = [s3_config.get(k) for k in ("endpoint_url", "region", "bucket", "prefix")]
+    canonical = json.dumps(
+        {
+            "workflows": _normalize(workflows),
+            "inputs": input_digests,
+            "s3": destination,
+            "output_format": output_format,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded on-disk LRU of final job results.
+
+    Each entry is a JSON file holding the final images list: S3 URLs for
+    S3 jobs, base64 data otherwise. Recency is tracked in memory and via file
+    mtimes so the order survives a handler restart.
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] | None = None
+        self._size = 0
 
-    return results
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self):
+        """Index existing entries, oldest first (caller holds the lock)."""
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    def get(self, key: str) -> list[dict] | None:
+        """Return cached results for key, or None on a miss."""
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key)) as f:
+                results = json.load(f)
+            os.utime(self._path(key))
+            return results
+        except (OSError, ValueError):
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+            return None
+
+    def put(self, key: str, results: list[dict]):
+        """Store results under key, evicting least recently used entries to stay in budget."""
+        data = json.dumps(results).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._load()
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".put-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._size > self.max_bytes:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.unlink(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+
+result_cache = ResultCache()
+
+
+def input_digests(images: list[dict], fetched: dict[str, str] | None = None) -> dict[str, str] | None:
+    """Content hashes of a job's input images, or None if any isn't known yet.
+
+    Inline images are hashed directly. A url/s3:// reference is only known
+    once this job has fetched it (`fetched`, filled in by upload_images());
+    whatever an earlier job wrote under the same name says nothing about
+    the content behind this job's reference.
+    """
+    digests = {}
+    for img in images:
+        if "image" in img:
+            digests[img["name"]] = hashlib.sha256(base64.b64decode(img["image"])).hexdigest()
+        elif fetched and img["name"] in fetched:
+            digests[img["name"]] = fetched[img["name"]]
+        else:
+            return None
+    return digests
 
 
 # ---------------------------------------------------------------------------
 # Main handler
 # ---------------------------------------------------------------------------
 
-def handler(job: dict):
-    """RunPod serverless handler function (generator for streaming progress)."""
+def handler(job: dict, cancel: threading.Event | None = None):
+    """RunPod serverless handler function (generator for streaming progress).
+
+    Setting `cancel` stops the job within EVENT_POLL_INTERVAL and releases its
+    prompts in ComfyUI. Each finished job's timings are folded into the
+    worker's metrics.
+    """
+    timing = JobTiming()
+    job_input = job.get("input") or {}
+    last = None
+    try:
+        if not (PROFILE_JOBS or job_input.get("profile") is True):
+            for chunk in run_job(job, timing, cancel):
+                last = chunk
+                yield chunk
+            return
+
+        profiler = JobProfiler()
+        chunks = run_job(job, timing, cancel)
+        try:
+            while (chunk := profiler.step(chunks)) is not None:
+                if "images" in chunk or "error" in chunk:
+                    # The result is the last chunk; attach the profile to it
+                    profiler.stop()
+                    try:
+                        chunk["profile"] = profiler.save(str(job.get("id", "job")), timing, job_input.get("s3"))
+                    except Exception as e:
+                        print(f"Failed to save profile: {e}")
+                last = chunk
+                yield chunk
+        finally:
+            profiler.stop()
+            chunks.close()
+    finally:
+        if last is None or "error" in last:
+            metrics.record_job(timing, "error")
+        elif "images" in last:
+            metrics.record_job(timing, "success", last.get("cache"))
+        else:
+            metrics.record_job(timing, "cancelled")
+
+
+def run_job(job: dict, timing: JobTiming, cancel: threading.Event | None = None):
+    """Run one job, yielding progress chunks and then its result, recording timings as it goes.
+
+    Once `cancel` is set the job stops without a result. Whenever the job ends
+    with prompts still queued or executing (cancelled, timed out, stalled,
+    closed early), they are removed from ComfyUI's queue and interrupted.
+    """
     job_input = job.get("input", {})
+    cancelled = cancel.is_set if cancel is not None else lambda: False
 
     # Validate
     validated, error = validate_input(job_input)
@@ -251,168 +2192,450 @@ def handler(job: dict):
         yield {"error": error}
         return
 
-    workflow = validated["workflow"]
+    workflows = expand_batch(validated)
+    is_batch = "workflows" in validated or "overrides" in validated
     images = validated.get("images", [])
     s3_config = validated.get("s3")
+    output_format = validated.get("output_format")
     mm_config = validated.get("model_manager")
+    timeout = validated.get("timeout", JOB_TIMEOUT)
+    stall_timeout = validated.get("stall_timeout", STALL_TIMEOUT)
+    # Preview chunks stay in the aggregated result, so only jobs that ask get them
+    send_previews = validated.get("previews", False) and PREVIEW_INTERVAL > 0
+
+    # Identical jobs (same canonical workflows and input content) reuse stored results
+    use_cache = result_cache.enabled and validated.get("cache", True)
+    cache_key = None
+    # Content hashes of the url/s3:// inputs, once this job has fetched them
+    fetched: dict[str, str] = {}
+
+    def cached_result() -> dict | None:
+        nonlocal cache_key
+        digests = input_digests(images, fetched)
+        if digests is None:
+            return None
+        cache_key = result_cache_key(workflows, digests, s3_config, output_format)
+        results = result_cache.get(cache_key)
+        if results is None:
+            return None
+        return {"images": results, "timing": timing.as_dict(), "cache": "hit"}
 
     # Pre-compute node metadata for progress reporting
-    total_nodes = len(workflow)
-    node_types = {nid: node.get("class_type", "Unknown") for nid, node in workflow.items()}
+    total_nodes = sum(len(wf) for wf in workflows)
+    node_types = [{nid: node.get("class_type", "Unknown") for nid, node in wf.items()} for wf in workflows]
 
-    # Wait for ComfyUI — yield periodic updates so the frontend stays alive
-    server_ready = False
-    wait_start = time.time()
-    for attempt in range(500):
-        try:
-            resp = requests.get(f"{COMFYUI_URL}/system_stats", timeout=2)
-            if resp.status_code == 200:
-                server_ready = True
-                break
-        except requests.ConnectionError:
-            pass
-        # Yield an update every ~1s (every 20 attempts at 0.05s delay)
-        if attempt % 20 == 0:
-            elapsed_wait = round(time.time() - wait_start, 1)
-            yield {
-                "status": "waiting",
-                "message": f"Waiting for ComfyUI server... ({elapsed_wait}s)",
-                "elapsed": elapsed_wait,
-            }
-        time.sleep(0.05)
+    if use_cache and (hit := cached_result()):
+        yield hit
+        return
 
-    if not server_ready:
-        yield {"error": "ComfyUI server failed to start"}
+    # Fetch catalog models the workflows reference but this worker doesn't have yet
+    try:
+        missing = model_cache.missing(workflows)
+    except OSError as e:
+        yield {"error": f"Failed to check models: {e}"}
         return
+    if missing:
+        fetch_start = time.monotonic()
+        fetches = [model_cache.fetch(name) for name in missing]
+        while True:
+            if cancelled():
+                return
+            downloaded, total = model_cache.progress(missing)
+            pct = f" ({downloaded / total * 100:.0f}%)" if total else ""
+            yield {
+                "status": "downloading",
+                "message": f"Downloading model {', '.join(missing)}{pct}",
+                "models": missing,
+                "downloaded": downloaded,
+                "total": total,
+            }
+            if not wait_futures(fetches, timeout=1.0).not_done:
+                break
+        for name, fetch in zip(missing, fetches):
+            if fetch.exception():
+                yield {"error": f"Failed to download model {name}: {fetch.exception()}"}
+                return
+        timing.add("model_download", time.monotonic() - fetch_start)
+    model_cache.touch(model_cache.referenced(workflows), hold=max(timeout, MODEL_EVICT_GRACE))
+
+    def tag(chunk: dict, index: int) -> dict:
+        """Label a progress chunk with its batch item for batch jobs."""
+        if is_batch:
+            chunk["batch_index"] = index
+        return chunk
+
+    # Wait for ComfyUI unless it's already known-ready — yield updates so the frontend stays alive
+    wait_start = time.time()
+    wait_started = time.monotonic()
+    while not server_monitor.ready:
+        if cancelled():
+            return
+        # Also catches a crash from before this job arrived that ComfyUI hasn't recovered from
+        if report := comfy_supervisor.exit_report(since=server_monitor.last_healthy):
+            yield {"error": report}
+            return
+        elapsed_wait = round(time.time() - wait_start, 1)
+        if elapsed_wait >= SERVER_WAIT_TIMEOUT:
+            yield {"error": "ComfyUI server failed to start"}
+            return
+        yield {
+            "status": "waiting",
+            "message": f"Waiting for ComfyUI server... ({elapsed_wait}s)",
+            "elapsed": elapsed_wait,
+        }
+        server_monitor.wait(timeout=1.0)
+    timing.add("server_wait", time.monotonic() - wait_started)
 
     yield {"status": "waiting", "message": "ComfyUI server ready", "elapsed": round(time.time() - wait_start, 1)}
 
     # Configure model manager if credentials provided
     if mm_config:
         try:
-            configure_model_manager(mm_config)
+            with timing.phase("model_manager"):
+                configure_model_manager(mm_config)
         except Exception as e:
             yield {"error": f"Failed to configure model manager: {e}"}
             return
 
+    # Reject broken workflows before they reach ComfyUI. The model manager can
+    # fetch models during execution, so combo values aren't checked with it.
+    rejected: dict[int, str] = {}
+    if WORKFLOW_PREFLIGHT:
+        with timing.phase("preflight"):
+            try:
+                info = object_info.get()
+            except requests.RequestException as e:
+                print(f"Preflight skipped, could not fetch /object_info: {e}")
+                info = None
+            if info is not None:
+                model_dirs = object_info.model_dirs()
+                for index, wf in enumerate(workflows):
+                    problems = preflight(wf, info, check_values=not mm_config, model_dirs=model_dirs)
+                    if problems:
+                        rejected[index] = f"Workflow failed preflight: {'; '.join(problems[:10])}"
+            if rejected and not is_batch:
+                yield {"error": rejected[0]}
+                return
+
     # Upload input images if provided
     if images:
         yield {"status": "uploading", "message": f"Uploading {len(images)} input image(s)..."}
         try:
-            upload_images(images)
+            with timing.phase("upload"):
+                skipped = upload_images(images, s3_config=s3_config, fetched=fetched)
         except Exception as e:
-            yield {"error": f"Failed to upload images: {e}"}
+            yield {"error": f"Failed to upload images: {comfy_supervisor.explain(e, wait_started) or e}"}
             return
+        timing.count("uploads_skipped", skipped)
+        with _input_index_lock:
+            timing.count("input_bytes", sum(_input_index.get(img["name"], ("", 0))[1] for img in images))
 
-    # Connect WebSocket before queueing to avoid missing completion events
-    client_id = str(uuid.uuid4())
-    try:
-        ws = connect_ws(client_id)
-    except Exception as e:
-        yield {"error": f"Failed to connect WebSocket: {e}"}
-        return
+        # Fetched inputs are only hashed once they've been downloaded
+        if use_cache and cache_key is None and (hit := cached_result()):
+            yield hit
+            return
 
-    # Queue the workflow
-    yield {"status": "queued", "message": "Submitting workflow to ComfyUI...", "total_nodes": total_nodes}
+    # Connect the shared WebSocket before queueing to avoid missing completion events
+    hub = get_hub()
     try:
-        prompt_id = queue_workflow(workflow, client_id)
-    except RuntimeError as e:
-        ws.close()
-        yield {"error": str(e)}
+        hub.start()
+    except Exception as e:
+        yield {"error": f"Failed to connect WebSocket: {comfy_supervisor.explain(e, wait_started) or e}"}
         return
 
-    # Stream progress from WebSocket
+    # Queue every workflow up front; they all report into one event queue
+    message = "Submitting workflow to ComfyUI..."
+    if is_batch:
+        message = f"Submitting {len(workflows)} workflows to ComfyUI..."
+    yield {"status": "queued", "message": message, "total_nodes": total_nodes}
+
+    events = queue.Queue()
+    prompts: dict[str, int] = {}
+    # Prompts queued in ComfyUI that haven't finished; released if the job ends early
+    running: set[str] = set()
+    errors = []
+    submit_start = time.monotonic()
     try:
-        exec_start = time.time()
-        timeout = 600
-        current_node = None
-        nodes_done = 0
-        while time.time() - exec_start < timeout:
-            message = ws.recv()
-            if isinstance(message, str):
-                data = json.loads(message)
-                msg_type = data.get("type")
+        for index, wf in enumerate(workflows):
+            if cancelled():
+                return
+            if index in rejected:
+                errors.append({"batch_index": index, "error": rejected[index]})
+                continue
+            try:
+                prompt_id = queue_workflow(wf, hub.client_id)
+            except RuntimeError as e:
+                if not is_batch:
+                    yield {"error": str(e)}
+                    return
+                errors.append({"batch_index": index, "error": str(e)})
+                continue
+            except requests.RequestException as e:
+                yield {"error": f"Failed to queue workflow: {comfy_supervisor.explain(e, wait_started) or e}"}
+                return
+            prompts[prompt_id] = index
+            running.add(prompt_id)
+            hub.subscribe(prompt_id, events)
+
+        if not prompts:
+            yield {"error": f"All {len(workflows)} workflows were rejected: {errors[0]['error']}"}
+            return
+        queued_at = time.monotonic()
+        timing.add("queue", queued_at - submit_start)
 
-                if msg_type == "execution_start":
-                    exec_data = data.get("data", {})
-                    if exec_data.get("prompt_id") == prompt_id:
+        # Stream progress from WebSocket; outputs are collected as their nodes finish
+        collector = OutputCollector(s3_config, output_format=output_format, budget=InlineBudget(), timing=timing)
+        try:
+            exec_start = time.time()
+            current_node = None
+            # First execution_start across the job, the prompts that have started, when
+            # the last event for one of them arrived, and the node each prompt is executing since when
+            started_at = None
+            started: set[str] = set()
+            last_event = time.monotonic()
+            executing: dict[str, tuple[str, float]] = {}
+
+            def finish_node(prompt_id: str, index: int):
+                if prompt_id in executing:
+                    node, since = executing.pop(prompt_id)
+                    class_type = node_types[index].get(node, "Unknown")
+                    timing.node(node, class_type, time.monotonic() - since, batch_index=index if is_batch else None)
+
+            nodes_done = 0
+            with_outputs = set()
+            progress = Throttle(PROGRESS_INTERVAL)
+            previews = Throttle(PREVIEW_INTERVAL)
+            while running:
+                if cancelled():
+                    return
+                if started_at is not None and time.monotonic() - started_at >= timeout:
+                    yield {"error": f"Workflow did not complete within {timeout:g}s"}
+                    return
+                # Queued prompts wait silently; only a started one is expected to report
+                if stall_timeout and running & started and time.monotonic() - last_event >= stall_timeout:
+                    yield {"error": f"Workflow stalled: no progress from node {current_node} for {stall_timeout:g}s"}
+                    return
+                try:
+                    prompt_id, data = events.get(timeout=EVENT_POLL_INTERVAL)
+                except queue.Empty:
+                    prompt_id, data = None, None
+                if prompt_id is not None:
+                    last_event = time.monotonic()
+                index = prompts.get(prompt_id, 0)
+                types = node_types[index]
+
+                if isinstance(data, tuple):
+                    # Latent preview frame; only the latest one per interval is decoded
+                    if send_previews:
+                        previews.offer((index, data[0].get("node_id") or current_node, data[1]))
+
+                elif isinstance(data, dict):
+                    msg_type = data.get("type")
+
+                    if msg_type == "execution_start":
                         exec_start = time.time()
-                        yield {
+                        started.add(prompt_id)
+                        if started_at is None:
+                            started_at = time.monotonic()
+                            timing.add("queue_wait", started_at - queued_at)
+                        yield tag({
                             "status": "executing",
                             "message": "Execution started",
                             "total_nodes": total_nodes,
                             "elapsed": 0,
-                        }
-
-                elif msg_type == "progress":
-                    prog = data.get("data", {})
-                    yield {
-                        "status": "running",
-                        "node": current_node,
-                        "node_type": node_types.get(current_node, "Unknown"),
-                        "node_index": nodes_done,
-                        "total_nodes": total_nodes,
-                        "progress": prog.get("value", 0),
-                        "max": prog.get("max", 0),
-                        "elapsed": round(time.time() - exec_start, 1),
-                    }
-
-                elif msg_type == "executing":
-                    exec_data = data.get("data", {})
-                    if exec_data.get("prompt_id") != prompt_id:
-                        continue
-                    node = exec_data.get("node")
-                    if node is None:
-                        break  # Workflow complete
-                    current_node = node
-                    nodes_done += 1
-                    yield {
-                        "status": "running",
-                        "message": f"Executing {node_types.get(node, 'node')}...",
-                        "node": node,
-                        "node_type": node_types.get(node, "Unknown"),
-                        "node_index": nodes_done,
-                        "total_nodes": total_nodes,
-                        "elapsed": round(time.time() - exec_start, 1),
-                    }
-
-                elif msg_type == "execution_error":
-                    error_data = data.get("data", {})
-                    yield {"error": f"ComfyUI execution error: {error_data.get('exception_message', 'Unknown error')}"}
-                    return
+                        }, index)
 
-                elif msg_type == "execution_cached":
-                    cached = data.get("data", {})
-                    nodes = cached.get("nodes", [])
-                    if nodes:
-                        nodes_done += len(nodes)
-                        yield {
+                    elif msg_type == "progress":
+                        prog = data.get("data", {})
+                        progress.offer(tag({
                             "status": "running",
-                            "message": f"Cached {len(nodes)} node(s)",
+                            "node": current_node,
+                            "node_type": types.get(current_node, "Unknown"),
                             "node_index": nodes_done,
                             "total_nodes": total_nodes,
+                            "progress": prog.get("value", 0),
+                            "max": prog.get("max", 0),
                             "elapsed": round(time.time() - exec_start, 1),
-                        }
-        else:
-            yield {"error": f"Workflow did not complete within {timeout}s"}
+                        }, index))
+
+                    elif msg_type == "executing":
+                        exec_data = data.get("data", {})
+                        node = exec_data.get("node")
+                        # A node transition supersedes any step progress still pending
+                        progress.clear()
+                        finish_node(prompt_id, index)
+                        if node is None:
+                            # This prompt is complete
+                            previews.clear()
+                            running.discard(prompt_id)
+                            hub.unsubscribe(prompt_id)
+                            if prompt_id not in with_outputs:
+                                # No executed events seen (e.g. older ComfyUI); fall back to history
+                                with timing.phase("history"):
+                                    collector.submit_history(prompt_id, {"batch_index": index} if is_batch else None)
+                            continue
+                        executing[prompt_id] = (node, time.monotonic())
+                        current_node = node
+                        nodes_done += 1
+                        yield tag({
+                            "status": "running",
+                            "message": f"Executing {types.get(node, 'node')}...",
+                            "node": node,
+                            "node_type": types.get(node, "Unknown"),
+                            "node_index": nodes_done,
+                            "total_nodes": total_nodes,
+                            "elapsed": round(time.time() - exec_start, 1),
+                        }, index)
+
+                    elif msg_type == "executed":
+                        # Cached output nodes report output=None
+                        exec_data = data.get("data", {})
+                        with_outputs.add(prompt_id)
+                        collector.submit(
+                            exec_data.get("node"),
+                            exec_data.get("output") or {},
+                            {"batch_index": index} if is_batch else None,
+                        )
+
+                    elif msg_type == "connection_lost":
+                        # A crash drops the socket a moment before the supervisor sees the exit
+                        report = comfy_supervisor.exit_report(since=queued_at, wait=2.0)
+                        if report:
+                            running.clear()  # Went down with the process
+                        yield {"error": report or "Lost WebSocket connection to ComfyUI"}
+                        return
+
+                    elif msg_type in ("execution_error", "execution_interrupted"):
+                        error_data = data.get("data", {})
+                        if msg_type == "execution_interrupted":
+                            error = "ComfyUI execution was interrupted"
+                        else:
+                            error = f"ComfyUI execution error: {error_data.get('exception_message', 'Unknown error')}"
+                        finish_node(prompt_id, index)
+                        running.discard(prompt_id)
+                        if not is_batch:
+                            yield {"error": error}
+                            return
+                        hub.unsubscribe(prompt_id)
+                        errors.append({"batch_index": index, "error": error})
+                        yield tag({"status": "running", "message": f"Batch item {index} failed: {error}"}, index)
+
+                    elif msg_type == "execution_cached":
+                        cached = data.get("data", {})
+                        nodes = cached.get("nodes", [])
+                        for node in nodes:
+                            timing.node(node, types.get(node, "Unknown"), 0.0, True, index if is_batch else None)
+                        if nodes:
+                            nodes_done += len(nodes)
+                            yield tag({
+                                "status": "running",
+                                "message": f"Cached {len(nodes)} node(s)",
+                                "node_index": nodes_done,
+                                "total_nodes": total_nodes,
+                                "elapsed": round(time.time() - exec_start, 1),
+                            }, index)
+
+                if chunk := progress.take():
+                    yield chunk
+                if frame := previews.take():
+                    frame_index, frame_node, image = frame
+                    if chunk := preview_chunk(image, frame_node):
+                        yield tag(chunk, frame_index)
+
+                for result in collector.ready():
+                    yield from output_chunks(result)
+
+            if started_at is not None:
+                timing.add("execution", time.monotonic() - started_at)
+
+            # Collect results still in flight
+            yield {"status": "collecting", "message": "Collecting outputs..."}
+            with timing.phase("collect"):
+                for result in collector.drain():
+                    yield from output_chunks(result)
+                results = collector.results()
+        except Exception as e:
+            yield {"error": f"Failed to collect outputs: {comfy_supervisor.explain(e, wait_started) or e}"}
             return
+        finally:
+            collector.close()
     finally:
-        ws.close()
-
-    # Collect results
-    yield {"status": "collecting", "message": "Collecting output images..."}
-    try:
-        results = collect_outputs(prompt_id, s3_config)
-    except Exception as e:
-        yield {"error": f"Failed to collect outputs: {e}"}
-        return
+        for prompt_id in prompts:
+            hub.unsubscribe(prompt_id)
+        if running:
+            # Don't leave the GPU working on a job nobody is waiting for
+            cancel_prompts(sorted(running), hub.running)
 
     if not results:
-        yield {"error": "No output images produced"}
+        detail = f": {errors[0]['error']}" if errors else ""
+        yield {"error": f"No outputs produced{detail}"}
         return
 
-    yield {"images": results}
+    results.sort(key=lambda r: r.get("batch_index", 0))
+    final = {"images": results, "timing": timing.as_dict(), "cache": "miss" if use_cache else "bypass"}
+    if errors:
+        final["errors"] = errors
+    elif use_cache and cache_key is not None and not any(r.get("chunked") for r in results):
+        # Chunked outputs only exist in the stream, so there's nothing to replay
+        result_cache.put(cache_key, results)
+    yield final
+
+
+_DONE = object()
+
+
+async def async_handler(job: dict):
+    """Async wrapper around handler() so several jobs can be in flight per worker.
+
+    Each job's blocking generator runs on its own thread and hands chunks back
+    to the event loop; RunPod keeps up to MAX_CONCURRENCY of these running.
+    When RunPod cancels the job, `stop` tells handler() to release its prompts.
+    """
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(chunks.put_nowait, item)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    def run():
+        gen = handler(job, stop)
+        try:
+            for chunk in gen:
+                put(chunk)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            gen.close()
+            put(_DONE)
+
+    threading.Thread(target=run, name=f"job-{job.get('id', '')}", daemon=True).start()
+    try:
+        while (item := await chunks.get()) is not _DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """Tell RunPod how many jobs this worker may run at once."""
+    return max(1, MAX_CONCURRENCY)
 
 
 if __name__ == "__main__":
-    runpod.serverless.start({"handler": handler, "return_aggregate_stream": True})
+    if COMFYUI_SUPERVISE:
+        comfy_supervisor.start()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    runpod.serverless.start({
+        "handler": async_handler,
+        "concurrency_modifier": concurrency_modifier,
+        "return_aggregate_stream": True,
+    })
@@ -31,8 +31,20 @@ def submit_workflow(endpoint: str, api_key: str, workflow: dict) -> str:
     return data["id"]
 
 
-def stream_progress(endpoint: str, api_key: str, job_id: str, interval: float = 0.5) -> dict:
-    """Poll the /stream endpoint for progress updates. Returns the final output."""
+def write_part(output: dict, output_dir: str):
+    """Write one output_part chunk of a large output to its file in output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    filepath = os.path.join(output_dir, output["filename"])
+    with open(filepath, "wb" if output["part"] == 0 else "ab") as f:
+        f.write(base64.b64decode(output["data"]))
+
+
+def stream_progress(endpoint: str, api_key: str, job_id: str, output_dir: str, interval: float = 0.5) -> dict:
+    """Poll the /stream endpoint for progress updates. Returns the final output.
+
+    Large outputs arrive as sequenced output_part chunks and are written to
+    output_dir as they stream in.
+    """
     stream_url = f"{endpoint}/stream/{job_id}"
     status_url = f"{endpoint}/status/{job_id}"
     headers = {"Authorization": f"Bearer {api_key}"}
@@ -65,6 +77,11 @@ def stream_progress(endpoint: str, api_key: str, job_id: str, interval: float =
                 final_output = output
                 continue
 
+            if output.get("status") == "output_part":
+                write_part(output, output_dir)
+                print(f"  [{elapsed:.0f}s] {output['filename']}: part {output['part'] + 1}/{output['parts']}", file=sys.stderr)
+                continue
+
             status = output.get("status", "")
             message = output.get("message", "")
             progress = output.get("progress")
@@ -95,6 +112,9 @@ def stream_progress(endpoint: str, api_key: str, job_id: str, interval: float =
             # Aggregated output is a list of all yielded chunks — find the final one
             agg = status_data.get("output", [])
             if isinstance(agg, list):
+                for chunk in agg:
+                    if isinstance(chunk, dict) and chunk.get("status") == "output_part":
+                        write_part(chunk, output_dir)
                 for chunk in reversed(agg):
                     if isinstance(chunk, dict) and ("images" in chunk or "error" in chunk):
                         return chunk
@@ -123,6 +143,8 @@ def save_images(output: dict, output_dir: str):
 
         if "url" in img:
             print(f"  {filename}: {img['url']}", file=sys.stderr)
+        elif img.get("chunked"):
+            print(f"  Saved: {filepath} ({img['parts']} parts)", file=sys.stderr)
         elif "data" in img:
             image_bytes = base64.b64decode(img["data"])
             with open(filepath, "wb") as f:
@@ -149,7 +171,7 @@ def main():
     job_id = submit_workflow(args.endpoint, args.api_key, workflow)
     print(f"Job ID: {job_id}", file=sys.stderr)
 
-    output = stream_progress(args.endpoint, args.api_key, job_id)
+    output = stream_progress(args.endpoint, args.api_key, job_id, args.output_dir)
 
     if "error" in output:
         print(f"Error: {output['error']}", file=sys.stderr)
@@ -1,58 +1,528 @@
 #!/usr/bin/env python3
 """Download models declared in config/models.yaml to ComfyUI model directories."""
 
+import fcntl
+import hashlib
+import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.parse import urlparse
 
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
 
-COMFYUI_MODELS_DIR = Path("/comfyui/models")
+COMFYUI_DIR = Path(os.environ.get("COMFYUI_DIR", "/comfyui"))
+COMFYUI_MODELS_DIR = COMFYUI_DIR / "models"
+EXTRA_MODEL_PATHS = COMFYUI_DIR / "extra_model_paths.yaml"
 MANIFEST_PATH = Path(__file__).parent.parent / "config" / "models.yaml"
-CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+CHUNK_SIZE = 1024 * 1024  # 1 MB per read; keeps bandwidth limiting smooth
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co")
 
+# Files downloaded at once, Range requests in flight per file, and connections across everything
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "4"))
+DOWNLOAD_SEGMENTS = int(os.environ.get("DOWNLOAD_SEGMENTS", "8"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.environ.get("DOWNLOAD_MAX_CONNECTIONS", "16"))
+# Size of each Range segment; a file is fetched as these, in order, DOWNLOAD_SEGMENTS at a time
+SEGMENT_MIN_SIZE = int(os.environ.get("DOWNLOAD_SEGMENT_MIN_SIZE", str(64 * 1024 * 1024)))
 
-def download_file(url: str, dest: Path, headers: dict | None = None):
-    """Download a file with progress reporting. Skips if already exists."""
+# Total bandwidth cap in bytes/s across all downloads (0 = unlimited)
+DOWNLOAD_MAX_BPS = int(os.environ.get("DOWNLOAD_MAX_BPS", "0"))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", "3"))
+
+# How often segment progress is persisted for resume
+STATE_SAVE_INTERVAL = 2.0
+
+# Records verified files (size, mtime, sha256) so restarts skip rehashing
+LOCKFILE_NAME = "models.lock.json"
+
+# Download missing models onto the network volume instead of the container disk
+POPULATE_NETWORK_VOLUME = os.environ.get("POPULATE_NETWORK_VOLUME", "").lower() in ("1", "true", "yes")
+
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=DOWNLOAD_MAX_CONNECTIONS))
+_session.mount("https://", HTTPAdapter(pool_maxsize=DOWNLOAD_MAX_CONNECTIONS))
+
+
+class RateLimiter:
+    """Token bucket shared by every download stream. A rate of 0 disables limiting."""
+
+    def __init__(self, max_bps: int = DOWNLOAD_MAX_BPS):
+        self.max_bps = max_bps
+        self._lock = threading.Lock()
+        self._allowance = float(max_bps)
+        self._last = time.monotonic()
+
+    def consume(self, nbytes: int):
+        if self.max_bps <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.max_bps, self._allowance + (now - self._last) * self.max_bps)
+            self._last = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.max_bps if self._allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+_limiter = RateLimiter()
+_connections = threading.BoundedSemaphore(DOWNLOAD_MAX_CONNECTIONS)
+
+
+class PartialDownload:
+    """Segment plan and progress for one file, persisted next to its .tmp for resume.
+
+    Each segment is [start, end, done]: bytes start..end-1 of the file, of
+    which the first `done` have been written. With `checksum`, the SHA-256
+    is computed while the download runs by hashing the contiguous prefix
+    already on disk. Segments are fetched in file order, so that prefix
+    trails the writers by a few segments and is read back from the page
+    cache; only those last few segments are hashed after the final one lands
+    (and, on resume, whatever an earlier run had written).
+    """
+
+    def __init__(self, name: str, state_path: Path, total: int, segments: list[list[int]], checksum: bool = True):
+        self.name = name
+        self.state_path = state_path
+        self.path = state_path.with_suffix("")
+        self.total = total
+        self.segments = segments
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._last_report = 0
+        self._hasher = hashlib.sha256()
+        self._hashed = 0
+        self._hash_lock = threading.Lock()
+        self.checksum = checksum
+        self.on_progress = None
+
+    @classmethod
+    def load(cls, name: str, state_path: Path, total: int) -> "PartialDownload | None":
+        """Load a saved plan, or None if there isn't one for a file of this size."""
+        try:
+            state = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            return None
+        if state.get("total") != total or not isinstance(state.get("segments"), list):
+            return None
+        return cls(name, state_path, total, state["segments"])
+
+    @classmethod
+    def plan(cls, name: str, state_path: Path, total: int, have: int) -> "PartialDownload":
+        """Plan segments for a file whose first `have` bytes are already on disk."""
+        segments = [[0, have, have]] if have else []
+        for start in range(have, total, SEGMENT_MIN_SIZE):
+            segments.append([start, min(start + SEGMENT_MIN_SIZE, total), 0])
+        return cls(name, state_path, total, segments)
+
+    @property
+    def downloaded(self) -> int:
+        return sum(seg[2] for seg in self.segments)
+
+    def advance(self, segment: list[int], nbytes: int):
+        with self._lock:
+            segment[2] += nbytes
+            now = time.monotonic()
+            if now - self._last_save >= STATE_SAVE_INTERVAL:
+                self._save()
+                self._last_save = now
+            self._report()
+            if self.on_progress:
+                self.on_progress(self.downloaded, self.total)
+        if self.checksum:
+            self._hash_written(block=False)
+
+    def sha256(self) -> str | None:
+        """Finish hashing whatever is left and return the hex digest (None without `checksum`)."""
+        if not self.checksum:
+            return None
+        self._hash_written(block=True)
+        return self._hasher.hexdigest()
+
+    def _written_prefix(self) -> int:
+        """Length of the contiguous run of written bytes starting at offset 0."""
+        with self._lock:
+            end = 0
+            for start, stop, done in sorted(self.segments):
+                if start > end:
+                    break
+                end = max(end, start + done)
+                if done < stop - start:
+                    break
+            return end
+
+    def _hash_written(self, block: bool):
+        # Only one thread hashes at a time; the others keep downloading
+        if not self._hash_lock.acquire(blocking=block):
+            return
+        try:
+            end = self._written_prefix()
+            if end <= self._hashed:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._hashed)
+                while self._hashed < end:
+                    chunk = f.read(min(CHUNK_SIZE, end - self._hashed))
+                    if not chunk:
+                        break
+                    self._hasher.update(chunk)
+                    self._hashed += len(chunk)
+        finally:
+            self._hash_lock.release()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        tmp = self.state_path.with_suffix(self.state_path.suffix + ".new")
+        tmp.write_text(json.dumps({"total": self.total, "segments": self.segments}))
+        tmp.replace(self.state_path)
+
+    def _report(self):
+        """Print a progress line every 10% so concurrent downloads stay readable."""
+        pct = int(self.downloaded / self.total * 10) if self.total else 0
+        if pct > self._last_report:
+            self._last_report = pct
+            print(f"  [progress] {self.name}: {self.downloaded / 1e9:.2f}/{self.total / 1e9:.2f} GB ({pct * 10}%)", flush=True)
+
+
+def probe(url: str, headers: dict) -> tuple[str, int, bool]:
+    """Resolve redirects and return (final_url, total_size, supports_ranges)."""
+    with _session.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        if resp.status_code == 206 and "/" in resp.headers.get("content-range", ""):
+            total = resp.headers["content-range"].rsplit("/", 1)[1]
+            if total.isdigit():
+                return resp.url, int(total), True
+        return resp.url, int(resp.headers.get("content-length", 0)), False
+
+
+def _headers_for(url: str, original_url: str, headers: dict) -> dict:
+    """Only send auth headers to the host they were meant for."""
+    return headers if urlparse(url).netloc == urlparse(original_url).netloc else {}
+
+
+def fetch_segment(url: str, headers: dict, path: Path, segment: list[int], download: PartialDownload, limiter: RateLimiter, connections):
+    """Download one Range segment into its slot in the preallocated file, retrying on network errors."""
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        start, end = segment[0] + segment[2], segment[1]
+        if start >= end:
+            return
+        try:
+            with connections, _session.get(
+                url, headers={**headers, "Range": f"bytes={start}-{end - 1}"}, stream=True, timeout=300
+            ) as resp:
+                resp.raise_for_status()
+                if resp.status_code != 206:
+                    raise RuntimeError(f"Server ignored Range request for {download.name}")
+                fd = os.open(path, os.O_WRONLY)
+                try:
+                    offset = start
+                    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                        chunk = chunk[:end - offset]
+                        limiter.consume(len(chunk))
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        download.advance(segment, len(chunk))
+                finally:
+                    os.close(fd)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+    if segment[0] + segment[2] < segment[1]:
+        raise RuntimeError(f"Segment {segment[0]}-{segment[1]} of {download.name} ended early")
+
+
+def fetch_stream(
+    url: str, headers: dict, tmp: Path, total: int, limiter: RateLimiter, connections, progress=None, checksum: bool = True
+) -> str | None:
+    """Download a file in a single stream, for servers that don't support Range. Returns its SHA-256 if `checksum`."""
+    hasher = hashlib.sha256() if checksum else None
+    downloaded = 0
+    with connections, _session.get(url, headers=headers, stream=True, timeout=300) as resp:
+        resp.raise_for_status()
+        with open(tmp, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                limiter.consume(len(chunk))
+                f.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+                downloaded += len(chunk)
+                if progress:
+                    progress(downloaded, total)
+    if total and downloaded != total:
+        raise RuntimeError(f"Expected {total} bytes, got {downloaded}")
+    return hasher.hexdigest() if hasher else None
+
+
+def hash_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class Lockfile:
+    """Verified model files keyed by path, with the size and mtime they were verified at.
+
+    A file whose size and mtime still match its entry is trusted without
+    rehashing, so restarts validate gigabytes of models instantly.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self.entries = json.loads(path.read_text()).get("files", {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def lookup(self, dest: Path) -> dict | None:
+        """Return the entry for dest if the file is unchanged since it was recorded."""
+        with self._lock:
+            entry = self.entries.get(str(dest))
+        if entry is None:
+            return None
+        try:
+            stat = dest.stat()
+        except OSError:
+            return None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        return entry
+
+    def record(self, dest: Path, sha256: str | None):
+        stat = dest.stat()
+        with self._lock:
+            self.entries[str(dest)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+            tmp = self.path.with_suffix(self.path.suffix + ".new")
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp.write_text(json.dumps({"files": self.entries}, indent=2, sort_keys=True))
+                tmp.replace(self.path)
+            except OSError as e:
+                # A read-only volume just means the file gets verified again next time
+                print(f"  [warn] Could not update {self.path}: {e}")
+
+
+def verify_existing(dest: Path, sha256: str | None, size: int | None, lock: Lockfile | None) -> bool:
+    """Check an existing file against the manifest; True if it can be kept.
+
+    Files already in the lockfile are trusted if unchanged. Otherwise the
+    declared size and sha256 (when given) are checked once and recorded.
+    """
+    entry = lock.lookup(dest) if lock else None
+    if entry is not None and (not sha256 or entry.get("sha256") == sha256):
+        return True
+
+    if size is not None and dest.stat().st_size != size:
+        print(f"  [corrupt] {dest} is {dest.stat().st_size} bytes, expected {size}")
+        return False
+
+    digest = None
+    if sha256:
+        print(f"  [verify] {dest}")
+        digest = hash_file(dest)
+        if digest != sha256:
+            print(f"  [corrupt] {dest} sha256 {digest} != {sha256}")
+            return False
+
+    if lock:
+        lock.record(dest, digest or (entry or {}).get("sha256"))
+    return True
+
+
+def download_file(
+    url: str,
+    dest: Path,
+    headers: dict | None = None,
+    limiter: RateLimiter = _limiter,
+    connections=_connections,
+    segments: int = DOWNLOAD_SEGMENTS,
+    sha256: str | None = None,
+    size: int | None = None,
+    lock: Lockfile | None = None,
+    progress=None,
+):
+    """Download a file, in parallel Range segments when the server allows.
+
+    An existing file is kept if it passes verify_existing(); a corrupt one is
+    downloaded again. Progress lives in dest.tmp plus a dest.tmp.parts
+    sidecar, so an interrupted download resumes where it left off. A .tmp
+    without a sidecar (e.g. from a single-stream download) is resumed as a
+    completed prefix; a sidecar planned for a different size is discarded
+    together with its .tmp. Segments are fetched in file order, `segments` at
+    a time. When the manifest declares a sha256, the hash follows the bytes
+    as they land and is checked before the file is moved into place;
+    otherwise the file isn't hashed at all. `progress`,
+    if given, is called with (downloaded, total) as bytes arrive.
+    """
     if dest.exists():
-        print(f"  [skip] {dest} already exists")
-        return
+        if verify_existing(dest, sha256, size, lock):
+            print(f"  [skip] {dest} already exists")
+            return
+        dest.unlink()
 
+    headers = headers or {}
     dest.parent.mkdir(parents=True, exist_ok=True)
     tmp = dest.with_suffix(dest.suffix + ".tmp")
+    state_path = tmp.with_suffix(tmp.suffix + ".parts")
 
     print(f"  [download] {url}")
     print(f"         -> {dest}")
 
-    resp = requests.get(url, headers=headers, stream=True, timeout=300)
-    resp.raise_for_status()
+    final_url, total, ranges = probe(url, headers)
+    final_headers = _headers_for(final_url, url, headers)
+    if size is not None and total and total != size:
+        raise RuntimeError(f"Server reports {total} bytes for {dest.name}, manifest expects {size}")
 
-    total = int(resp.headers.get("content-length", 0))
-    downloaded = 0
+    if ranges and total:
+        download = PartialDownload.load(dest.name, state_path, total)
+        if download is None and state_path.exists():
+            # The sidecar belongs to another version of the file, whose .tmp is
+            # preallocated rather than a written prefix
+            print(f"  [restart] {dest.name}: saved progress doesn't match the server's file")
+            tmp.unlink(missing_ok=True)
+            state_path.unlink()
+        if download is None:
+            have = tmp.stat().st_size if tmp.exists() else 0
+            if have > total:
+                tmp.unlink()
+                have = 0
+            download = PartialDownload.plan(dest.name, state_path, total, have)
+        download.checksum = bool(sha256)
+        download.on_progress = progress
+        if download.downloaded:
+            print(f"  [resume] {dest.name} from {download.downloaded / 1e9:.2f} GB")
+
+        with open(tmp, "r+b" if tmp.exists() else "wb") as f:
+            f.truncate(total)
+        download.save()
 
-    with open(tmp, "wb") as f:
-        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
-            f.write(chunk)
-            downloaded += len(chunk)
-            if total:
-                pct = downloaded / total * 100
-                print(f"\r  {downloaded / 1e9:.2f}/{total / 1e9:.2f} GB ({pct:.1f}%)", end="", flush=True)
+        pending = [seg for seg in download.segments if seg[2] < seg[1] - seg[0]]
+        try:
+            # Submitted in file order, so the hashed prefix keeps up with the writers
+            with ThreadPoolExecutor(max_workers=max(1, min(segments, len(pending)))) as pool:
+                futures = [
+                    pool.submit(fetch_segment, final_url, final_headers, tmp, seg, download, limiter, connections)
+                    for seg in pending
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            download.save()
+        digest = download.sha256()
+    else:
+        digest = fetch_stream(final_url, final_headers, tmp, total, limiter, connections, progress, bool(sha256))
 
-    if total:
-        print()
+    if sha256 and digest != sha256:
+        tmp.unlink()
+        state_path.unlink(missing_ok=True)
+        raise RuntimeError(f"sha256 mismatch for {dest.name}: got {digest}, expected {sha256}")
 
     tmp.rename(dest)
-    print(f"  [done] {dest.name}")
+    state_path.unlink(missing_ok=True)
+    if lock:
+        lock.record(dest, digest)
+    print(f"  [done] {dest.name}" + (f" (sha256 {digest})" if digest else ""))
+
+
+def download_exclusive(url: str, dest: Path, headers: dict | None = None, **kwargs):
+    """download_file() under an exclusive flock on dest.lock, for files on a shared volume.
+
+    Workers populating the same volume would otherwise race on dest.tmp and
+    its sidecar. Whoever waits for the lock finds dest in place and only
+    verifies it.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with open(dest.with_name(dest.name + ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        download_file(url, dest, headers, **kwargs)
 
 
 def build_hf_url(repo: str, filepath: str) -> str:
-    return f"https://huggingface.co/{repo}/resolve/main/{filepath}"
+    return f"{HF_ENDPOINT.rstrip('/')}/{repo}/resolve/main/{filepath}"
+
+
+def iter_manifest(config: dict):
+    """Yield (repo, url, dest_subdir, filename, sha256, size) for every file in a manifest."""
+    for model in config.get("models") or []:
+        for file_entry in model["files"]:
+            filepath = file_entry["path"]
+            yield (
+                model["repo"],
+                build_hf_url(model["repo"], filepath),
+                file_entry["dest"],
+                Path(filepath).name,
+                file_entry.get("sha256"),
+                file_entry.get("size"),
+            )
+
+
+def auth_headers() -> dict:
+    hf_token = os.environ.get("HF_TOKEN")
+    return {"Authorization": f"Bearer {hf_token}"} if hf_token else {}
+
+
+def load_extra_roots(path: Path) -> list[tuple[Path, dict[str, list[Path]]]]:
+    """Parse ComfyUI's extra_model_paths.yaml into (base_path, {folder: [dirs]}) per section."""
+    if not path.exists():
+        return []
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    roots = []
+    for section in config.values():
+        if not isinstance(section, dict):
+            continue
+        base = Path(os.path.expandvars(os.path.expanduser(section.get("base_path", ""))))
+        if not base.is_absolute():
+            base = path.parent / base
+        folders = {}
+        for key, value in section.items():
+            if key in ("base_path", "is_default") or not isinstance(value, str):
+                continue
+            folders[key] = [base / line.strip() for line in value.splitlines() if line.strip()]
+        roots.append((base, folders))
+    return roots
+
+
+def locate(dest_subdir: str, filename: str, models_dir: Path, extra_roots) -> list[tuple[Path, Path, bool]]:
+    """Every place a manifest file could already exist, as (path, root, visible_to_comfyui).
+
+    Searched in order: the container's models directory, the folders
+    registered in extra_model_paths.yaml, then the same subdirectory under
+    each extra base_path even where ComfyUI isn't told to look.
+    """
+    parts = Path(dest_subdir).parts
+    folder, rest = parts[0], Path(*parts[1:]) if len(parts) > 1 else Path()
+
+    candidates = [(models_dir / dest_subdir / filename, models_dir, True)]
+    for base, folders in extra_roots:
+        for directory in folders.get(folder, []):
+            candidates.append((directory / rest / filename, base, True))
+    for base, _ in extra_roots:
+        candidates.append((base / dest_subdir / filename, base, False))
+    return candidates
 
 
 def main():
     models_dir = Path(os.environ.get("COMFYUI_MODELS_DIR", COMFYUI_MODELS_DIR))
     manifest = Path(os.environ.get("MODELS_MANIFEST", MANIFEST_PATH))
+    extra_roots = load_extra_roots(Path(os.environ.get("EXTRA_MODEL_PATHS", EXTRA_MODEL_PATHS)))
 
     if not manifest.exists():
         print(f"No manifest found at {manifest}, skipping model download")
@@ -65,28 +535,80 @@ def main():
         print("No models defined in manifest")
         return
 
-    headers = {}
-    hf_token = os.environ.get("HF_TOKEN")
-    if hf_token:
-        headers["Authorization"] = f"Bearer {hf_token}"
+    headers = auth_headers()
+    if headers:
         print("Using HuggingFace auth token")
 
-    for model in config["models"]:
-        repo = model["repo"]
-        print(f"\nModel repo: {repo}")
+    locks = {models_dir: Lockfile(Path(os.environ.get("MODELS_LOCKFILE", models_dir / LOCKFILE_NAME)))}
 
-        for file_entry in model["files"]:
-            filepath = file_entry["path"]
-            dest_subdir = file_entry["dest"]
-            filename = Path(filepath).name
-            dest = models_dir / dest_subdir / filename
-            url = build_hf_url(repo, filepath)
+    def lock_for(root: Path) -> Lockfile:
+        if root not in locks:
+            locks[root] = Lockfile(root / LOCKFILE_NAME)
+        return locks[root]
+
+    volume = None
+    if POPULATE_NETWORK_VOLUME:
+        if extra_roots:
+            volume = extra_roots[0]
+            print(f"Populating network volume at {volume[0]}")
+        else:
+            print("POPULATE_NETWORK_VOLUME is set but no extra model paths are configured")
 
+    downloads = []
+    current_repo = None
+    for repo, url, dest_subdir, filename, sha256, size in iter_manifest(config):
+        if repo != current_repo:
+            current_repo = repo
+            print(f"\nModel repo: {repo}")
+
+        # Only folders ComfyUI searches on the volume can be populated there
+        target_root = models_dir
+        if volume and Path(dest_subdir).parts[0] in volume[1]:
+            target_root = volume[0]
+        dest = target_root / dest_subdir / filename
+        print(f"  {filename} -> {dest_subdir}")
+        download = (url, dest, sha256, size, lock_for(target_root), target_root != models_dir)
+
+        if dest.is_file() and not dest.is_symlink():
+            # download_file verifies it against the lockfile and manifest
+            downloads.append(download)
+            continue
+
+        for path, root, visible in locate(dest_subdir, filename, models_dir, extra_roots):
+            if path == dest or not path.is_file():
+                continue
+            if not verify_existing(path, sha256, size, lock_for(root)):
+                continue
+            if visible:
+                print(f"  [skip] {filename} found at {path}")
+            else:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.unlink(missing_ok=True)
+                dest.symlink_to(path)
+                print(f"  [link] {dest} -> {path}")
+            break
+        else:
+            downloads.append(download)
+
+    print()
+    failed = False
+    with ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_CONCURRENCY)) as pool:
+        futures = {
+            pool.submit(
+                download_exclusive if shared else download_file,
+                url, dest, headers or None, sha256=sha256, size=size, lock=lock,
+            ): dest
+            for url, dest, sha256, size, lock, shared in downloads
+        }
+        for future in as_completed(futures):
             try:
-                download_file(url, dest, headers=headers or None)
-            except requests.HTTPError as e:
-                print(f"  [error] Failed to download {filename}: {e}", file=sys.stderr)
-                sys.exit(1)
+                future.result()
+            except (requests.RequestException, OSError, RuntimeError) as e:
+                print(f"  [error] Failed to download {futures[future].name}: {e}", file=sys.stderr)
+                failed = True
+
+    if failed:
+        sys.exit(1)
 
     print("\nAll models downloaded successfully")
 
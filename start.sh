@@ -10,18 +10,14 @@ if [ -d "/runpod-volume/models" ]; then
     cp /app/config/extra_model_paths.yaml /comfyui/extra_model_paths.yaml
 fi
 
-# Download models if not already present
+# Download models not already present on the container disk or network volume
 echo "Checking models..."
 python /app/scripts/download_models.py
 
-echo "Starting ComfyUI server..."
-cd /comfyui
-python main.py \
-    --disable-auto-launch \
-    --disable-metadata \
-    --listen \
-    --port 8188 &
+# The handler launches ComfyUI itself and restarts it if it exits
+export COMFYUI_SUPERVISE=1
+export COMFYUI_ARGS="${COMFYUI_ARGS:---disable-auto-launch --disable-metadata --preview-method ${COMFYUI_PREVIEW_METHOD:-latent2rgb} --listen --port 8188}"
 
 echo "Starting RunPod handler..."
 cd /app
-python -u handler.py
+exec python -u handler.py
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Benchmark handler.py against the fake ComfyUI in test/fake_comfyui.py.
+
+Starts the fake ComfyUI (and optionally fake S3) in a subprocess, runs jobs
+through handler() in this process and reports throughput, the p50/p95/p99 of
+every phase in the jobs' `timing`, the handler's own overhead (wall time not
+spent queued or executing in ComfyUI) and peak RSS. Results can be saved
+with --json and compared against an earlier run with --baseline.
+
+Usage:
+    python test/bench_handler.py --jobs 50 --concurrency 4 --outputs 4 --output-size 2000000
+    python test/bench_handler.py --s3 --json bench.json
+    python test/bench_handler.py --baseline bench.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+TEST_DIR = Path(__file__).parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+
+def build_workflow(nodes: int, seed: int) -> dict:
+    """LoadImage -> BenchStep x (nodes - 2) -> SaveImage."""
+    workflow = {"1": {"class_type": "LoadImage", "inputs": {"image": "bench_input.png"}}}
+    for i in range(2, nodes):
+        workflow[str(i)] = {"class_type": "BenchStep", "inputs": {"image": [str(i - 1), 0], "seed": seed}}
+    workflow[str(nodes)] = {
+        "class_type": "SaveImage",
+        "inputs": {"images": [str(nodes - 1), 0], "filename_prefix": "bench"},
+    }
+    return workflow
+
+
+def start_fake(args, port: int, s3_port: int) -> subprocess.Popen:
+    cmd = [
+        sys.executable, str(TEST_DIR / "fake_comfyui.py"),
+        "--port", str(port),
+        "--s3-port", str(s3_port),
+        "--steps", str(args.steps),
+        "--progress-rate", str(args.progress_rate),
+        "--node-delay", str(args.node_delay),
+        "--outputs", str(args.outputs),
+        "--output-size", str(args.output_size),
+    ]
+    if args.png:
+        cmd.append("--png")
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/system_stats", timeout=1).raise_for_status()
+            return proc
+        except requests.RequestException:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Fake ComfyUI did not start")
+
+
+def run_jobs(handler, args, s3_config: dict | None) -> tuple[list[dict], list[str], float]:
+    """Run args.jobs jobs, args.concurrency at a time. Returns (timings, errors, wall seconds)."""
+    timings, errors = [], []
+    lock = threading.Lock()
+    next_job = iter(range(args.jobs))
+    input_data = base64.b64encode(os.urandom(args.input_size)).decode() if args.input_size else None
+
+    def worker():
+        while True:
+            with lock:
+                index = next(next_job, None)
+            if index is None:
+                return
+            job_input = {"workflow": build_workflow(args.nodes, index), "cache": False}
+            if input_data:
+                # Same name and content every job, like a client reusing a reference image
+                job_input["images"] = [{"name": "bench_input.png", "image": input_data}]
+            if s3_config:
+                job_input["s3"] = dict(s3_config, prefix=f"bench/{index}/")
+            if args.format:
+                job_input["output_format"] = {"format": args.format}
+            final = None
+            for chunk in handler({"id": f"bench-{index}", "input": job_input}):
+                final = chunk
+            with lock:
+                if final is None or "error" in final:
+                    errors.append((final or {}).get("error", "no result"))
+                else:
+                    timings.append(final["timing"])
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, args.concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors, time.monotonic() - start
+
+
+def summarize(timings: list[dict], wall: float, args) -> dict:
+    phases: dict[str, list[float]] = {}
+    for timing in timings:
+        for name, value in timing.items():
+            if isinstance(value, float) and not name.startswith(("outputs_", "output_bytes_")):
+                phases.setdefault(name, []).append(value)
+        overhead = timing["total"] - timing.get("queue_wait", 0.0) - timing.get("execution", 0.0)
+        phases.setdefault("overhead", []).append(overhead)
+    output_bytes = sum(v for t in timings for k, v in t.items() if k.startswith("output_bytes_"))
+    return {
+        "jobs": len(timings),
+        "wall": round(wall, 3),
+        "jobs_per_second": round(len(timings) / wall, 3) if wall else 0.0,
+        "output_mb_per_second": round(output_bytes / wall / 1e6, 3) if wall else 0.0,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "phases": {
+            name: {f"p{pct}": round(percentile(values, pct) * 1000, 2) for pct in (50, 95, 99)}
+            for name, values in sorted(phases.items())
+        },
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+    }
+
+
+def report(summary: dict, baseline: dict | None):
+    def delta(new: float, old: float | None) -> str:
+        if old is None or not old:
+            return ""
+        return f" ({(new - old) / old * 100:+.0f}%)"
+
+    base_phases = (baseline or {}).get("phases", {})
+    print(f"\n{summary['jobs']} jobs in {summary['wall']:.2f}s")
+    for key, label in (
+        ("jobs_per_second", "jobs/s"),
+        ("output_mb_per_second", "output MB/s"),
+        ("peak_rss_mb", "peak RSS MB"),
+    ):
+        print(f"  {label:<14}{summary[key]:>10}{delta(summary[key], (baseline or {}).get(key))}")
+    print(f"\n  {'phase (ms)':<18}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in summary["phases"].items():
+        old = base_phases.get(name, {})
+        cells = "".join(f"{stats[p]:>10.2f}" for p in ("p50", "p95", "p99"))
+        print(f"  {name:<18}{cells}{delta(stats['p50'], old.get('p50'))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ComfyUI RunPod handler against a fake ComfyUI")
+    parser.add_argument("--jobs", type=int, default=20, help="Jobs to run")
+    parser.add_argument("--concurrency", type=int, default=1, help="Jobs in flight at once (like MAX_CONCURRENCY)")
+    parser.add_argument("--nodes", type=int, default=8, help="Nodes per workflow (at least 3)")
+    parser.add_argument("--steps", type=int, default=20, help="Progress events per step node")
+    parser.add_argument("--progress-rate", type=float, default=200.0, help="Progress events per second (0 = unthrottled)")
+    parser.add_argument("--node-delay", type=float, default=0.0, help="Seconds of simulated work per node")
+    parser.add_argument("--outputs", type=int, default=2, help="Outputs per job")
+    parser.add_argument("--output-size", type=int, default=1024 * 1024, help="Bytes per output")
+    parser.add_argument("--input-size", type=int, default=256 * 1024, help="Bytes of the inline input image (0 = none)")
+    parser.add_argument("--png", action="store_true", help="Produce decodable PNG outputs")
+    parser.add_argument("--format", choices=["png", "jpeg", "webp", "avif"], help="Request this output_format")
+    parser.add_argument("--s3", action="store_true", help="Deliver outputs to the fake S3 instead of inline")
+    parser.add_argument("--json", help="Write the summary to this file")
+    parser.add_argument("--baseline", help="Compare against a summary written earlier with --json")
+    args = parser.parse_args()
+    args.nodes = max(3, args.nodes)
+
+    port = free_port()
+    s3_port = free_port() if args.s3 else 0
+    proc = start_fake(args, port, s3_port)
+    try:
+        # handler.py reads its configuration at import time
+        os.environ["COMFYUI_URL"] = f"http://127.0.0.1:{port}"
+        scratch = tempfile.mkdtemp(prefix="bench-handler-")
+        os.environ.setdefault("COMFYUI_DIR", os.path.join(scratch, "comfyui"))
+        os.environ.setdefault("MODELS_CATALOG", os.path.join(scratch, "catalog.yaml"))
+        os.environ.setdefault("RESULT_CACHE_BYTES", "0")
+        os.environ.setdefault("METRICS_FILE", "")
+        os.environ.setdefault("MAX_CONCURRENCY", str(args.concurrency))
+        sys.path.insert(0, str(TEST_DIR.parent))
+        from handler import handler
+
+        s3_config = None
+        if args.s3:
+            s3_config = {
+                "bucket": "bench",
+                "access_key": "bench",
+                "secret_key": "bench",
+                "endpoint_url": f"http://127.0.0.1:{s3_port}",
+            }
+
+        print(f"Running {args.jobs} job(s), {args.concurrency} at a time...")
+        timings, errors, wall = run_jobs(handler, args, s3_config)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    if errors:
+        print(f"{len(errors)} job(s) failed, e.g.: {errors[0]}")
+    if not timings:
+        sys.exit(1)
+
+    summary = summarize(timings, wall, args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(summary, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSaved summary to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""Stand-in ComfyUI and S3 servers for benchmarking the handler without a GPU.
+
+The fake ComfyUI implements just enough of the real API for handler.py:
+/system_stats, /object_info, /upload/image, /prompt, /queue, /interrupt,
+/history, /view and the /ws event stream. Prompts run one at a time like ComfyUI's queue; every node
+reports `executing`, BenchStep nodes stream `progress` events and SaveImage
+nodes write output files. The fake S3 accepts PutObject and multipart uploads
+into memory so S3 output delivery can be measured too.
+
+Usage:
+    python test/fake_comfyui.py --port 8188 --s3-port 9000 --steps 20 --outputs 4
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Node classes the benchmark workflow is built from, in /object_info shape
+OBJECT_INFO = {
+    "LoadImage": {
+        "input": {"required": {"image": [[], {"image_upload": True}]}},
+        "output": ["IMAGE", "MASK"],
+    },
+    "BenchStep": {
+        "input": {"required": {"image": ["IMAGE"], "seed": ["INT", {"min": 0}]}},
+        "output": ["IMAGE"],
+    },
+    "SaveImage": {
+        "input": {"required": {"images": ["IMAGE"], "filename_prefix": ["STRING", {}]}},
+        "output": [],
+    },
+}
+
+
+def ws_frame(payload: bytes, opcode: int) -> bytes:
+    """Encode one unmasked server-to-client WebSocket frame."""
+    header = bytes([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        header += bytes([n])
+    elif n < 65536:
+        header += bytes([126]) + struct.pack(">H", n)
+    else:
+        header += bytes([127]) + struct.pack(">Q", n)
+    return header + payload
+
+
+class FakeComfyUI:
+    """Prompt queue, history and WebSocket clients shared by the request handlers."""
+
+    def __init__(
+        self,
+        output_dir: str,
+        steps: int = 20,
+        progress_rate: float = 200.0,
+        node_delay: float = 0.0,
+        outputs: int = 1,
+        output_size: int = 1024 * 1024,
+        png: bool = False,
+    ):
+        self.output_dir = output_dir
+        self.steps = steps
+        self.progress_rate = progress_rate
+        self.node_delay = node_delay
+        self.outputs = outputs
+        self.output_size = output_size
+        self.png = png
+        self.history: dict[str, dict] = {}
+        self.uploads = 0
+        self._clients: dict[str, socket.socket] = {}
+        self._clients_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._deleted: set[str] = set()
+        self._interrupted = threading.Event()
+        self.interrupts = 0
+        self._counter = 0
+        self._payload = self._make_payload()
+        threading.Thread(target=self._execute, name="executor", daemon=True).start()
+
+    def _make_payload(self) -> bytes:
+        """Bytes written for every output: random noise, optionally as a PNG of about that size."""
+        if not self.png:
+            return os.urandom(self.output_size)
+        from PIL import Image
+
+        side = max(1, int((self.output_size / 3) ** 0.5))
+        buf = io.BytesIO()
+        Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(buf, "PNG")
+        return buf.getvalue()
+
+    def connect(self, client_id: str, sock: socket.socket):
+        with self._clients_lock:
+            self._clients[client_id] = sock
+
+    def disconnect(self, client_id: str):
+        with self._clients_lock:
+            self._clients.pop(client_id, None)
+
+    def send(self, client_id: str, message):
+        with self._clients_lock:
+            sock = self._clients.get(client_id)
+        if sock is None:
+            return
+        if isinstance(message, bytes):
+            frame = ws_frame(message, 0x2)
+        else:
+            frame = ws_frame(json.dumps(message).encode(), 0x1)
+        try:
+            sock.sendall(frame)
+        except OSError:
+            self.disconnect(client_id)
+
+    def submit(self, prompt: dict, client_id: str | None) -> str:
+        prompt_id = str(uuid.uuid4())
+        self._queue.put((prompt_id, prompt, client_id))
+        return prompt_id
+
+    def delete(self, prompt_ids: list[str]):
+        """Drop prompts that haven't started yet."""
+        self._deleted.update(prompt_ids)
+
+    def interrupt(self):
+        self.interrupts += 1
+        self._interrupted.set()
+
+    def _execute(self):
+        while True:
+            prompt_id, prompt, client_id = self._queue.get()
+            if prompt_id in self._deleted:
+                continue
+            self._interrupted.clear()
+
+            def event(msg_type: str, **data):
+                self.send(client_id, {"type": msg_type, "data": {**data, "prompt_id": prompt_id}})
+
+            event("execution_start")
+            outputs = {}
+            for node_id, node in prompt.items():
+                event("executing", node=node_id)
+                if self.node_delay:
+                    self._interrupted.wait(self.node_delay)
+                class_type = node.get("class_type")
+                if class_type == "BenchStep":
+                    for step in range(self.steps):
+                        if self._interrupted.is_set():
+                            break
+                        event("progress", value=step + 1, max=self.steps, node=node_id)
+                        if self.progress_rate:
+                            time.sleep(1 / self.progress_rate)
+                if self._interrupted.is_set():
+                    event("execution_interrupted", node_id=node_id, node_type=class_type)
+                    break
+                elif class_type == "SaveImage":
+                    images = []
+                    for _ in range(self.outputs):
+                        self._counter += 1
+                        filename = f"bench_{self._counter:05d}_.png"
+                        with open(os.path.join(self.output_dir, filename), "wb") as f:
+                            f.write(self._payload)
+                        images.append({"filename": filename, "subfolder": "", "type": "output"})
+                    outputs[node_id] = {"images": images}
+                    event("executed", node=node_id, output=outputs[node_id])
+            self.history[prompt_id] = {"outputs": outputs, "status": {"completed": not self._interrupted.is_set()}}
+            event("executing", node=None)
+            if not self._interrupted.is_set():
+                event("execution_success")
+
+
+class ComfyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "ComfyServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj, code: int = 200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        comfy = self.server.comfy
+        if url.path == "/system_stats":
+            return self._json({"system": {"python_version": "fake"}, "devices": []})
+        if url.path == "/object_info":
+            return self._json(OBJECT_INFO)
+        if url.path.startswith("/history/"):
+            prompt_id = url.path.rsplit("/", 1)[-1]
+            entry = comfy.history.get(prompt_id)
+            return self._json({prompt_id: entry} if entry else {})
+        if url.path == "/view":
+            path = os.path.join(comfy.output_dir, os.path.basename(query.get("filename", "")))
+            if not os.path.isfile(path):
+                return self._json({}, 404)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, "rb") as f:
+                while block := f.read(1024 * 1024):
+                    self.wfile.write(block)
+            return
+        if url.path == "/ws":
+            return self._websocket(query.get("clientId") or uuid.uuid4().hex)
+        self._json({}, 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urllib.parse.urlparse(self.path)
+        comfy = self.server.comfy
+        if url.path == "/prompt":
+            data = json.loads(body)
+            prompt_id = comfy.submit(data["prompt"], data.get("client_id"))
+            return self._json({"prompt_id": prompt_id, "number": 0, "node_errors": {}})
+        if url.path == "/queue":
+            comfy.delete(json.loads(body or b"{}").get("delete", []))
+            return self._json({})
+        if url.path == "/interrupt":
+            comfy.interrupt()
+            return self._json({})
+        if url.path == "/upload/image":
+            comfy.uploads += 1
+            return self._json({"name": "upload", "subfolder": "", "type": "input"})
+        self._json({}, 404)
+
+    def _websocket(self, client_id: str):
+        key = self.headers["Sec-WebSocket-Key"]
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        comfy = self.server.comfy
+        comfy.connect(client_id, self.connection)
+        comfy.send(client_id, {"type": "status", "data": {"sid": client_id}})
+        try:
+            # Drain client frames until it closes; pings get their pong
+            while True:
+                header = self.rfile.read(2)
+                if len(header) < 2:
+                    break
+                opcode, length = header[0] & 0x0F, header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self.rfile.read(8))[0]
+                mask = self.rfile.read(4) if header[1] & 0x80 else b""
+                payload = self.rfile.read(length)
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                if opcode == 0x8:
+                    self.connection.sendall(ws_frame(b"\x03\xe8", 0x8))
+                    break
+                if opcode == 0x9:
+                    self.connection.sendall(ws_frame(payload, 0xA))
+        except OSError:
+            pass
+        finally:
+            comfy.disconnect(client_id)
+        self.close_connection = True
+
+
+class ComfyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], comfy: FakeComfyUI):
+        super().__init__(address, ComfyRequestHandler)
+        self.comfy = comfy
+
+
+class FakeS3:
+    """In-memory object store covering the calls boto3's upload_fileobj makes."""
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.lock = threading.Lock()
+
+
+class S3RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "S3Server"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int = 200, body: bytes = b"", headers: dict | None = None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _xml(self, tag: str, fields: dict):
+        inner = "".join(f"<{k}>{escape(str(v))}</{k}>" for k, v in fields.items())
+        body = f'<?xml version="1.0" encoding="UTF-8"?><{tag}>{inner}</{tag}>'.encode()
+        self._reply(200, body, {"Content-Type": "application/xml"})
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while (size := int(self.rfile.readline().split(b";")[0], 16)) > 0:
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            while self.rfile.readline() not in (b"\r\n", b""):
+                pass
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            # Streaming payload with a trailing checksum: "<hex>\r\n<data>\r\n ... 0\r\n<trailer>"
+            stream, body = io.BytesIO(body), b""
+            while (size := int(stream.readline().split(b";")[0], 16)) > 0:
+                body += stream.read(size)
+                stream.readline()
+        return body
+
+    def _key(self) -> tuple[str, dict]:
+        url = urllib.parse.urlparse(self.path)
+        return urllib.parse.unquote(url.path.lstrip("/")), dict(urllib.parse.parse_qsl(url.query, True))
+
+    def do_PUT(self):
+        key, query = self._key()
+        body = self._read_body()
+        s3 = self.server.s3
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with s3.lock:
+            if "uploadId" in query:
+                s3.uploads[query["uploadId"]][int(query["partNumber"])] = body
+            else:
+                s3.objects[key] = body
+        self._reply(200, headers={"ETag": etag})
+
+    def do_POST(self):
+        key, query = self._key()
+        self._read_body()
+        s3 = self.server.s3
+        bucket, _, name = key.partition("/")
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with s3.lock:
+                s3.uploads[upload_id] = {}
+            return self._xml("InitiateMultipartUploadResult", {"Bucket": bucket, "Key": name, "UploadId": upload_id})
+        if "uploadId" in query:
+            with s3.lock:
+                parts = s3.uploads.pop(query["uploadId"])
+                s3.objects[key] = b"".join(parts[n] for n in sorted(parts))
+            return self._xml("CompleteMultipartUploadResult", {"Bucket": bucket, "Key": name, "ETag": '"multipart"'})
+        self._reply(400)
+
+    def do_GET(self):
+        key, _ = self._key()
+        with self.server.s3.lock:
+            body = self.server.s3.objects.get(key)
+        if body is None:
+            return self._reply(404)
+        self._reply(200, body)
+
+    def do_HEAD(self):
+        key, _ = self._key()
+        with self.server.s3.lock:
+            body = self.server.s3.objects.get(key)
+        self.send_response(200 if body is not None else 404)
+        self.send_header("Content-Length", str(len(body or b"")))
+        self.end_headers()
+
+
+class S3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], s3: FakeS3):
+        super().__init__(address, S3RequestHandler)
+        self.s3 = s3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake ComfyUI (and S3) server for handler benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188, help="ComfyUI port")
+    parser.add_argument("--s3-port", type=int, default=0, help="Also serve a fake S3 on this port (0 = off)")
+    parser.add_argument("--output-dir", help="Where outputs are written (default: a temp dir)")
+    parser.add_argument("--steps", type=int, default=20, help="Progress events per BenchStep node")
+    parser.add_argument("--progress-rate", type=float, default=200.0, help="Progress events per second (0 = unthrottled)")
+    parser.add_argument("--node-delay", type=float, default=0.0, help="Seconds each node takes before its progress")
+    parser.add_argument("--outputs", type=int, default=1, help="Files written per SaveImage node")
+    parser.add_argument("--output-size", type=int, default=1024 * 1024, help="Bytes per output file")
+    parser.add_argument("--png", action="store_true", help="Write decodable PNGs (for output_format) instead of noise")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="fake-comfyui-")
+    os.makedirs(output_dir, exist_ok=True)
+    comfy = FakeComfyUI(
+        output_dir, args.steps, args.progress_rate, args.node_delay, args.outputs, args.output_size, args.png
+    )
+    if args.s3_port:
+        s3_server = S3Server((args.host, args.s3_port), FakeS3())
+        threading.Thread(target=s3_server.serve_forever, name="s3", daemon=True).start()
+        print(f"Fake S3 on http://{args.host}:{args.s3_port}", flush=True)
+    print(f"Fake ComfyUI on http://{args.host}:{args.port} (outputs in {output_dir})", flush=True)
+    ComfyServer((args.host, args.port), comfy).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Tests for scripts/download_models.py against a local HTTP Range stand-in.
+
+Usage:
+    python -m pytest test/test_download_models.py
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+import download_models  # noqa: E402
+
+SEGMENT = 64 * 1024
+FILE = os.urandom(5 * SEGMENT + 1234)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves FILE at /model.bin, honouring single Range requests unless the path starts with /norange."""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        data = self.server.files.get(self.path.removeprefix("/norange"))
+        if data is None:
+            self.send_error(404)
+            return
+        start, end = 0, len(data)
+        spec = self.headers.get("Range")
+        if spec and not self.path.startswith("/norange"):
+            first, last = spec.removeprefix("bytes=").split("-")
+            start, end = int(first), min(int(last) + 1, len(data))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        self.wfile.write(data[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.files = {"/model.bin": FILE}
+    httpd.requests = []
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch, server):
+    monkeypatch.setattr(download_models, "SEGMENT_MIN_SIZE", SEGMENT)
+    server.requests.clear()
+
+
+def url(server, path="/model.bin") -> str:
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def fetch(server, dest: Path, path="/model.bin", **kwargs):
+    download_models.download_file(url(server, path), dest, sha256=hashlib.sha256(FILE).hexdigest(), **kwargs)
+
+
+def ranged(server) -> list[str]:
+    """Range headers of the segment requests, without the bytes=0-0 probe."""
+    return [r for _, r in server.requests if r and r != "bytes=0-0"]
+
+
+def segment_ranges(start: int) -> list[str]:
+    return [f"bytes={s}-{min(s + SEGMENT, len(FILE)) - 1}" for s in range(start, len(FILE), SEGMENT)]
+
+
+def test_segmented_download(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    fetch(server, dest, segments=4)
+    assert dest.read_bytes() == FILE
+    assert sorted(ranged(server)) == sorted(segment_ranges(0))
+    assert not dest.with_suffix(".bin.tmp").exists()
+    assert not dest.with_suffix(".bin.tmp.parts").exists()
+
+
+def test_segments_are_fetched_in_order(server, tmp_path):
+    # Keeps the hashed prefix moving forward with the download
+    fetch(server, tmp_path / "model.bin", segments=1)
+    assert ranged(server) == segment_ranges(0)
+
+
+def test_unverified_download_is_not_hashed(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    lock = download_models.Lockfile(tmp_path / download_models.LOCKFILE_NAME)
+    download_models.download_file(url(server), dest, lock=lock)
+    assert dest.read_bytes() == FILE
+    assert lock.lookup(dest)["sha256"] is None
+
+
+def test_resumes_from_sidecar(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    tmp = dest.with_suffix(".bin.tmp")
+    tmp.write_bytes(FILE[:SEGMENT] + bytes(len(FILE) - SEGMENT))
+    state = {"total": len(FILE), "segments": [[0, 2 * SEGMENT, SEGMENT], [2 * SEGMENT, len(FILE), 0]]}
+    dest.with_suffix(".bin.tmp.parts").write_text(json.dumps(state))
+    fetch(server, dest)
+    assert dest.read_bytes() == FILE
+    assert sorted(ranged(server)) == [f"bytes={2 * SEGMENT}-{len(FILE) - 1}", f"bytes={SEGMENT}-{2 * SEGMENT - 1}"]
+
+
+def test_resumes_bare_tmp_as_prefix(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    dest.with_suffix(".bin.tmp").write_bytes(FILE[:3 * SEGMENT])
+    fetch(server, dest, segments=1)
+    assert dest.read_bytes() == FILE
+    assert ranged(server) == segment_ranges(3 * SEGMENT)
+
+
+def test_complete_bare_tmp_is_moved_into_place(server, tmp_path):
+    # A download killed between the last write and the rename
+    dest = tmp_path / "model.bin"
+    dest.with_suffix(".bin.tmp").write_bytes(FILE)
+    fetch(server, dest)
+    assert dest.read_bytes() == FILE
+    assert ranged(server) == []
+
+
+def test_oversized_bare_tmp_is_discarded(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    dest.with_suffix(".bin.tmp").write_bytes(FILE + b"stale")
+    fetch(server, dest)
+    assert dest.read_bytes() == FILE
+
+
+@pytest.mark.parametrize("stale_total", [len(FILE) + SEGMENT, len(FILE) - SEGMENT])
+def test_mismatched_sidecar_discards_tmp(server, tmp_path, stale_total):
+    # The preallocated .tmp of another version must not be trusted as a prefix
+    dest = tmp_path / "model.bin"
+    dest.with_suffix(".bin.tmp").write_bytes(bytes(stale_total))
+    state = {"total": stale_total, "segments": [[0, stale_total, SEGMENT]]}
+    dest.with_suffix(".bin.tmp.parts").write_text(json.dumps(state))
+    download_models.download_file(url(server), dest)
+    assert dest.read_bytes() == FILE
+    assert not dest.with_suffix(".bin.tmp.parts").exists()
+
+
+def test_sha256_mismatch_is_rejected(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    with pytest.raises(RuntimeError, match="sha256 mismatch"):
+        download_models.download_file(url(server), dest, sha256="0" * 64)
+    assert not dest.exists()
+
+
+def test_server_without_ranges(server, tmp_path):
+    dest = tmp_path / "model.bin"
+    fetch(server, dest, path="/norange/model.bin")
+    assert dest.read_bytes() == FILE